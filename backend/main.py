@@ -1,15 +1,141 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
+import json
 import sys
 import os
+import threading
+import time
 
 # Add current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from utils.detector import detect_ai_image, download_image, safe_load_base64_image, get_detector_config
+# Thread and batching defaults measured by tools/autotune.py; the modules
+# below read them at import
+from utils.tuning import apply_profile
+apply_profile()
 
-app = FastAPI()
+from utils.detector import (
+    detect_ai_image, decode_image_bytes, decode_base64_image, safe_load_image_bytes, metadata_response,
+    get_detector_config, get_inference_stats, get_near_duplicate_stats, start_model, is_ready, get_model_status,
+    DownloadGuard, UPLOAD_MAX_BYTES, upload_header_allowed
+)
+from utils.fetch import fetch_image, start_http_client, close_http_client
+from utils.cache import ResultCache, image_digest
+from utils.provenance import PREFIX_SCAN_BYTES, PROVENANCE_SCAN, scan_provenance
+from utils.coalesce import COALESCE_ENABLED, AsyncSingleFlight, ThreadSingleFlight
+from utils import admission
+from utils.admission import (
+    ADMISSION_ENABLED, BULK_SLOTS, LANES, AdmissionController, Abandoned, ClientDisconnected, DeadlineExceeded,
+    Overloaded, current_ticket, item_ticket, lane_ticket, request_ticket
+)
+from utils.logs import configure_logging, logger
+from utils import metrics
+from utils.metrics import stage, record_outcome, with_timings, collect_timings, timings_requested
+from utils import profiler
+
+configure_logging()
+
+class TimedJSONResponse(JSONResponse):
+    """
+    JSONResponse that reports its encoding time as the "serialize" stage
+    With an opt-in "timings" block the result is encoded first and the
+    block, now holding serialize too, is appended to it.
+    """
+
+    def render(self, content) -> bytes:
+        timings = content.get("timings") if isinstance(content, dict) else None
+        if not isinstance(timings, dict):
+            with stage("serialize"):
+                return super().render(content)
+
+        started = time.perf_counter()
+        with stage("serialize"):
+            body = super().render({key: value for key, value in content.items() if key != "timings"})
+        timings = dict(timings, serialize=round((time.perf_counter() - started) * 1000.0, 2))
+        block = super().render({"timings": timings})
+        return body[:-1] + b"," + block[1:] if body != b"{}" else block
+
+app = FastAPI(default_response_class=TimedJSONResponse)
+
+# Threads that run decoding, preprocessing and inference off the event loop.
+# Downloads are sized separately by the HTTP pool in utils/fetch.py.
+INFERENCE_WORKERS = int(os.environ.get("SHIELD_INFERENCE_WORKERS", str(max(4, os.cpu_count() or 1))))
+
+inference_executor = ThreadPoolExecutor(
+    max_workers=INFERENCE_WORKERS,
+    thread_name_prefix="shield-inference"
+)
+
+# Priority lanes in front of the inference threads: hover scans ("interactive")
+# are served before uploads and batches ("bulk"); full queues are shed
+admission_control = AdmissionController(INFERENCE_WORKERS, BULK_SLOTS)
+
+# Server-side results by URL and by image content, shared by all users
+_config = get_detector_config()
+result_cache = ResultCache(namespace=f"{_config['model']}@{_config['version']}")
+
+# Identical concurrent requests share one download (by URL) and one inference (by content)
+# (a follower whose leader was abandoned runs the work itself)
+url_flight = AsyncSingleFlight("url", rerun_on=(Abandoned,))
+content_flight = ThreadSingleFlight("content", rerun_on=(Abandoned,))
+
+# Scrape-time views of state tracked by the batcher, the cache and the loader
+metrics.callback(
+    "shield_model_ready", "1 once the model is loaded and warmed up",
+    lambda: 1 if is_ready() else 0
+)
+metrics.callback(
+    "shield_batcher_queue_depth", "Requests waiting for the inference batcher",
+    lambda: get_inference_stats()["queue_depth"]
+)
+metrics.callback(
+    "shield_admission_queue_depth", "Requests waiting for an inference slot by lane",
+    lambda: {lane: info["queued"] for lane, info in admission_control.stats()["lanes"].items()},
+    labels=("lane",)
+)
+metrics.callback(
+    "shield_cache_events_total", "Result cache lookups by level and outcome",
+    lambda: {
+        key: value for key, value in result_cache.stats().items()
+        if key.endswith(("_hits", "_misses", "_revalidated"))
+    },
+    labels=("event",), kind="counter"
+)
+metrics.callback(
+    "shield_coalesced_total", "Requests that waited on an identical in-flight request",
+    lambda: {flight.name: flight.coalesced for flight in (url_flight, content_flight)},
+    labels=("level",), kind="counter"
+)
+metrics.callback(
+    "shield_near_duplicate_lookups_total", "Near-duplicate index lookups by outcome",
+    lambda: {
+        outcome: (get_near_duplicate_stats() or {}).get(key, 0)
+        for outcome, key in (("hit", "hits"), ("miss", "misses"))
+    },
+    labels=("outcome",), kind="counter"
+)
+metrics.callback(
+    "shield_cache_entries", "Result cache entries by level",
+    lambda: {level: result_cache.stats()[f"{level}_entries"] for level in ("url", "content")},
+    labels=("level",)
+)
+
+# Per-endpoint request metrics and the opt-in timings block
+app.add_middleware(
+    metrics.MetricsMiddleware,
+    endpoints=["/", "/detect", "/upload", "/upload/raw", "/detect/fast", "/detect/batch", "/provenance", "/metrics", "/stats", "/healthz", "/readyz"]
+)
+
+# Sampled profiles of slow requests (SHIELD_SLOW_REQUEST_MS; nothing runs when unset)
+if profiler.slow_requests is not None:
+    app.add_middleware(profiler.SlowRequestMiddleware)
 
 # CORS configuration
 app.add_middleware(
@@ -26,6 +152,240 @@ class DetectPayload(BaseModel):
 class UploadPayload(BaseModel):
     image: str
 
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    url: Optional[str] = None
+    image: Optional[str] = None
+
+class BatchPayload(BaseModel):
+    items: List[BatchItem]
+    ensemble: bool = True
+
+# Largest number of images accepted in one /detect/batch request
+BATCH_MAX_ITEMS = int(os.environ.get("SHIELD_BATCH_MAX_ITEMS", "256"))
+
+# Largest number of unfinished scans one /ws connection may have
+WS_MAX_IN_FLIGHT = int(os.environ.get("SHIELD_WS_MAX_IN_FLIGHT", "64"))
+
+WS_CONNECTIONS = metrics.gauge("shield_ws_connections", "Open /ws scan channels")
+
+@app.on_event("startup")
+async def startup():
+    await start_http_client()
+
+    # Load and warm up the model without holding up the server;
+    # /readyz reports 503 until this finishes
+    threading.Thread(target=start_model, name="shield-model-loader", daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_http_client()
+    inference_executor.shutdown(wait=False)
+
+def require_ready():
+    """Turn detection requests away while the model is still loading"""
+    if not is_ready():
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model not ready ({get_model_status()['phase']})",
+            headers={"Retry-After": "5"}
+        )
+
+def admit(lane: str, request: Request = None, shed=True, watch=True):
+    """
+    Give this request a ticket for its lane (deadline, disconnect checks)
+    Raises HTTPException(429/503) at once when the lane is already full.
+    shed=False: once admitted, the request's work waits for slots instead
+    of being turned away (batches, whose items queue one by one)
+    """
+    if not ADMISSION_ENABLED:
+        return None
+    try:
+        admission_control.check(lane)
+    except Overloaded as e:
+        raise admission_error(e)
+
+    ticket = request_ticket(lane, request, shed=shed, watch=watch)
+    current_ticket.set(ticket)
+    return ticket
+
+def admission_error(e: Exception) -> HTTPException:
+    """HTTP answer for work that was shed (Overloaded) or dropped (Abandoned)"""
+    if isinstance(e, Overloaded):
+        return HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    if isinstance(e, ClientDisconnected):
+        return HTTPException(status_code=499, detail=str(e))
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+async def run_inference(fn, *args, **kwargs):
+    """
+    Run CPU-bound work on the bounded inference executor (in this request's context, for stage timings)
+    With admission control the work first waits for a slot in its ticket's
+    lane, and the client is watched for disconnects while it runs
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(fn, *args, **kwargs)
+    ticket = current_ticket.get()
+
+    if not ADMISSION_ENABLED or ticket is None:
+        with metrics.INFERENCE_IN_FLIGHT.track():
+            return await loop.run_in_executor(inference_executor, context.run, call)
+
+    try:
+        async with admission_control.slot(ticket):
+            with metrics.INFERENCE_IN_FLIGHT.track():
+                try:
+                    return await admission.watch(ticket, loop.run_in_executor(inference_executor, context.run, call))
+                except Abandoned as e:
+                    admission_control.record_abandoned(ticket, e)
+                    raise
+    except asyncio.CancelledError:
+        # Cancelled from outside (a /ws cancel or a closed stream): the client is gone
+        admission_control.record_abandoned(ticket, ClientDisconnected())
+        raise
+
+def detect_upload_bytes(content: bytes, use_ensemble=True):
+    """
+    Detect an uploaded image file
+    Generator metadata in the raw bytes answers without decoding; otherwise
+    the image is validated, decoded once and run through detection.
+    None when the bytes are not a valid/safe image.
+    """
+    if PROVENANCE_SCAN:
+        with stage("provenance"):
+            hit = scan_provenance(content)
+        if hit.source:
+            logger.debug("AI detected via %s metadata: %s", hit.field, hit.source)
+            return metadata_response(hit.source, hit.field)
+
+    with stage("decode"):
+        img = safe_load_image_bytes(content)
+    if img is None:
+        return None
+    # Private images: never added to the near-duplicate index
+    return detect_image(img, use_ensemble=use_ensemble, check_metadata=True, remember=False)
+
+def detect_base64_upload(data: str, use_ensemble=True):
+    """detect_upload_bytes for a base64 string or data URL"""
+    with stage("decode"):
+        content = decode_base64_image(data)
+    if content is None:
+        return None
+    return detect_upload_bytes(content, use_ensemble=use_ensemble)
+
+def cache_mode(use_ensemble: bool) -> str:
+    if not use_ensemble:
+        return "fast"
+    return "adaptive" if _config["adaptive_ensemble"] else "ensemble"
+
+def _detect_and_store(img, mode, digest, use_ensemble, check_metadata, remember):
+    result = detect_ai_image(img, use_ensemble=use_ensemble, check_metadata=check_metadata, remember=remember)
+    if result.get("prediction") != "error":
+        result_cache.put_content(mode, digest, result)
+    return result
+
+def detect_image(img, use_ensemble=True, check_metadata=True, remember=True):
+    """
+    Run detection unless the same image content was classified before,
+    or is being classified right now (then wait for that result)
+    """
+    if not result_cache.enabled and not COALESCE_ENABLED:
+        return detect_ai_image(img, use_ensemble=use_ensemble, check_metadata=check_metadata, remember=remember)
+
+    mode = cache_mode(use_ensemble)
+    with stage("hash"):
+        digest = image_digest(img)
+
+    cached = result_cache.get_content(mode, digest)
+    if cached is not None:
+        cached["cache"] = "content"
+        return cached
+
+    if not COALESCE_ENABLED:
+        return _detect_and_store(img, mode, digest, use_ensemble, check_metadata, remember)
+
+    result, coalesced = content_flight.run(
+        (mode, digest), _detect_and_store, img, mode, digest, use_ensemble, check_metadata, remember
+    )
+    if coalesced:
+        result["coalesced"] = "content"
+    return result
+
+def detect_image_bytes(content: bytes, use_ensemble=True, check_metadata=True):
+    """Decode downloaded bytes and run detection; None if the bytes are not an image"""
+    with stage("decode"):
+        img = decode_image_bytes(content)
+    if img is None:
+        return None
+    return detect_image(img, use_ensemble=use_ensemble, check_metadata=check_metadata)
+
+async def detect_url(url: str, use_ensemble=True):
+    """
+    Detect an image by URL through the result cache
+    Returns None when the image could not be downloaded or decoded
+    """
+    mode = cache_mode(use_ensemble)
+
+    cached, stale = result_cache.lookup_url(mode, url)
+    if cached is not None:
+        cached["cache"] = "url"
+        return cached
+
+    if not COALESCE_ENABLED:
+        return await fetch_and_detect(url, mode, use_ensemble, stale)
+
+    # Concurrent requests for the same URL wait on one download and one inference
+    result, coalesced = await url_flight.run((mode, url), fetch_and_detect, url, mode, use_ensemble, stale)
+    if coalesced and result is not None:
+        result["coalesced"] = "url"
+    return result
+
+async def fetch_and_detect(url: str, mode: str, use_ensemble: bool, stale=None):
+    """Download (or revalidate a stale cache entry), detect and cache the result"""
+    fetch = fetch_image(
+        url,
+        etag=stale.get("etag") if stale else None,
+        last_modified=stale.get("last_modified") if stale else None
+    )
+
+    # The download counts against the request's deadline too
+    ticket = current_ticket.get()
+    if ADMISSION_ENABLED and ticket is not None:
+        try:
+            fetched = await asyncio.wait_for(fetch, max(0.0, ticket.remaining()))
+        except asyncio.TimeoutError:
+            error = DeadlineExceeded()
+            admission_control.record_abandoned(ticket, error)
+            raise error
+    else:
+        fetched = await fetch
+
+    if fetched.not_modified:
+        result = result_cache.revalidated(mode, url, stale)
+        result["cache"] = "url"
+        return result
+
+    if fetched.provenance is not None:
+        # Metadata at the start of the file named the generator: no decode, no model
+        result = metadata_response(fetched.provenance.source, fetched.provenance.field)
+        result_cache.put_url(mode, url, result, fetched.etag, fetched.last_modified)
+        return result
+
+    if fetched.content is None:
+        return None
+
+    result = await run_inference(
+        detect_image_bytes,
+        fetched.content,
+        use_ensemble=use_ensemble,
+        check_metadata=True
+    )
+
+    if result is not None and result.get("prediction") != "error":
+        result_cache.put_url(mode, url, result, fetched.etag, fetched.last_modified)
+    return result
+
 @app.get("/")
 async def root():
     """Health check and config info"""
@@ -33,6 +393,7 @@ async def root():
     return {
         "status": "AI Shield Backend Running",
         "version": "2.0-enhanced",
+        "ready": is_ready(),
         "model": config["model"],
         "features": {
             "ensemble_prediction": config["ensemble_enabled"],
@@ -42,24 +403,105 @@ async def root():
         }
     }
 
+@app.get("/healthz")
+async def liveness():
+    """Liveness: the process is up and serving HTTP (model may still be loading)"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness: 200 only once the model is loaded and warmed up"""
+    status = get_model_status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 @app.get("/config")
 async def get_config():
     """Get current detector configuration"""
     return get_detector_config()
 
+@app.get("/stats")
+async def get_stats():
+    """Get inference queue depth, batch-size, admission, cache, near-duplicate and coalescing stats"""
+    return {
+        "inference": get_inference_stats(),
+        "admission": dict(admission_control.stats(), enabled=ADMISSION_ENABLED),
+        "cache": result_cache.stats(),
+        "near_duplicates": get_near_duplicate_stats(),
+        "coalescing": {
+            "enabled": COALESCE_ENABLED,
+            "url": url_flight.stats(),
+            "content": content_flight.stats()
+        }
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: stage latencies, request counters, in-flight gauges"""
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
+
+def require_profiler(request: Request):
+    """404 unless the profiler is enabled, 403 without its token"""
+    denied = profiler.access_error(request.headers)
+    if denied is not None:
+        raise HTTPException(status_code=denied[0], detail=denied[1])
+
+def profile_response(report: dict, format: str):
+    if format == "collapsed":
+        return PlainTextResponse(report["collapsed"])
+    return report
+
+@app.post("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 10.0, torch: bool = False, format: str = "json"):
+    """
+    Sample every thread's stack for a window (at most 60s); with torch=1
+    also record torch.profiler operator tables. format=collapsed returns
+    just the collapsed stacks, ready for flamegraph.pl or speedscope.
+    """
+    require_profiler(request)
+    try:
+        report = await profiler.capture(seconds, with_torch=torch)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profile_response(report, format)
+
+@app.get("/debug/slow")
+async def debug_slow(request: Request):
+    """Requests slower than SHIELD_SLOW_REQUEST_MS whose profiles are still kept"""
+    require_profiler(request)
+    return {
+        "profiler": profiler.stats(),
+        "requests": profiler.slow_requests.list() if profiler.slow_requests is not None else []
+    }
+
+@app.get("/debug/slow/{profile_id}")
+async def debug_slow_profile(profile_id: int, request: Request, format: str = "json"):
+    """One kept slow-request profile"""
+    require_profiler(request)
+    entry = None
+    if profiler.slow_requests is not None:
+        # Summarized on first download, off the event loop
+        entry = await asyncio.get_running_loop().run_in_executor(None, profiler.slow_requests.report, profile_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="No such profile")
+    return profile_response(entry, format)
+
 @app.post("/detect")
-async def detect(payload: DetectPayload):
+async def detect(payload: DetectPayload, request: Request):
     """
     Detect AI-generated image from URL
     Enhanced with ensemble predictions and metadata checking
     """
+    require_ready()
+    admit("interactive", request)
+
     try:
-        print(f"\n[Shield] Processing URL: {payload.url[:80]}...")
+        logger.debug("Processing URL: %s...", payload.url[:80])
         
-        # Download image
-        img = download_image(payload.url)
+        # Download image (unless cached) and run enhanced detection with ensemble
+        result = await detect_url(payload.url, use_ensemble=True)
+        record_outcome("/detect", result)
 
-        if img is None:
+        if result is None:
             return {
                 "prediction": "error",
                 "ai_probability": 0.0,
@@ -67,18 +509,15 @@ async def detect(payload: DetectPayload):
                 "confidence": 0.0,
                 "error": "Failed to download image"
             }
-
-        # Enhanced detection with ensemble
-        result = detect_ai_image(
-            img, 
-            use_ensemble=True,      # Use ensemble for higher accuracy
-            check_metadata=True      # Check EXIF data first
-        )
         
-        return result
-    
+        return with_timings(result)
+
+    except (Overloaded, Abandoned) as e:
+        record_outcome("/detect", None)
+        raise admission_error(e)
     except Exception as e:
-        print(f"[Shield] Detection error: {e}")
+        logger.error("Detection error: %s", e)
+        record_outcome("/detect", None)
         return {
             "prediction": "error",
             "ai_probability": 0.0,
@@ -88,45 +527,100 @@ async def detect(payload: DetectPayload):
         }
 
 @app.post("/upload")
-async def upload_image(data: UploadPayload):
+async def upload_image(data: UploadPayload, request: Request):
     """
     Detect AI-generated image from base64 upload
     Enhanced with ensemble predictions and metadata checking
     """
+    require_ready()
+    admit("bulk", request)
+
     try:
-        print(f"\n[Shield] Processing uploaded image...")
+        logger.debug("Processing uploaded image...")
         
-        # Load base64 image
-        img = safe_load_base64_image(data.image)
+        # Metadata scan, then decode and enhanced detection with ensemble
+        result = await run_inference(detect_base64_upload, data.image, use_ensemble=True)
 
-        if img is None:
+        if result is None:
+            record_outcome("/upload", None)
             raise HTTPException(status_code=400, detail="Invalid or unsafe image")
 
-        # Enhanced detection with ensemble
-        result = detect_ai_image(
-            img,
-            use_ensemble=True,      # Use ensemble for higher accuracy
-            check_metadata=True      # Check EXIF data first
-        )
+        record_outcome("/upload", result)
         
-        return result
+        return with_timings(result)
     
     except HTTPException:
         raise
+    except (Overloaded, Abandoned) as e:
+        record_outcome("/upload", None)
+        raise admission_error(e)
+    except Exception as e:
+        logger.error("Upload error: %s", e)
+        record_outcome("/upload", None)
+        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+
+@app.post("/upload/raw")
+async def upload_raw(request: Request):
+    """
+    Detect AI-generated image from a binary upload (request body = image file)
+    Same 10MB / 4096px limits as /upload, enforced while the body streams
+    in, without the base64 overhead; the image is decoded once
+    """
+    require_ready()
+    admit("bulk", request)
+
+    guard = DownloadGuard(max_bytes=UPLOAD_MAX_BYTES, header_allowed=upload_header_allowed)
+    reason = guard.check_headers(request.headers)
+    if reason is None:
+        async for chunk in request.stream():
+            reason = guard.feed(chunk)
+            if reason:
+                break
+
+    if reason:
+        logger.warning("Rejecting upload: %s", reason)
+        record_outcome("/upload/raw", None)
+        status = 415 if reason.startswith("not an image") else 413
+        raise HTTPException(status_code=status, detail=f"Invalid or unsafe image: {reason}")
+
+    try:
+        logger.debug("Processing uploaded image (%d bytes)...", len(guard.buffer))
+
+        result = await run_inference(detect_upload_bytes, guard.content(), use_ensemble=True)
+
+        if result is None:
+            record_outcome("/upload/raw", None)
+            raise HTTPException(status_code=400, detail="Invalid or unsafe image")
+
+        record_outcome("/upload/raw", result)
+
+        return with_timings(result)
+
+    except HTTPException:
+        raise
+    except (Overloaded, Abandoned) as e:
+        record_outcome("/upload/raw", None)
+        raise admission_error(e)
     except Exception as e:
-        print(f"[Shield] Upload error: {e}")
+        logger.error("Upload error: %s", e)
+        record_outcome("/upload/raw", None)
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
 @app.post("/detect/fast")
-async def detect_fast(payload: DetectPayload):
+async def detect_fast(payload: DetectPayload, request: Request):
     """
     Fast detection mode (single prediction, no ensemble)
     Use this for quicker results when accuracy is less critical
     """
+    require_ready()
+    admit("interactive", request)
+
     try:
-        img = download_image(payload.url)
+        # Fast mode: single prediction, no ensemble
+        result = await detect_url(payload.url, use_ensemble=False)
+        record_outcome("/detect/fast", result)
         
-        if img is None:
+        if result is None:
             return {
                 "prediction": "error",
                 "ai_probability": 0.0,
@@ -134,16 +628,13 @@ async def detect_fast(payload: DetectPayload):
                 "error": "Failed to download image"
             }
 
-        # Fast mode: single prediction, no ensemble
-        result = detect_ai_image(
-            img,
-            use_ensemble=False,     # Single prediction only
-            check_metadata=True      # Still check metadata (instant)
-        )
-        
-        return result
-    
+        return with_timings(result)
+
+    except (Overloaded, Abandoned) as e:
+        record_outcome("/detect/fast", None)
+        raise admission_error(e)
     except Exception as e:
+        record_outcome("/detect/fast", None)
         return {
             "prediction": "error",
             "ai_probability": 0.0,
@@ -151,6 +642,261 @@ async def detect_fast(payload: DetectPayload):
             "error": str(e)
         }
 
+@app.post("/provenance")
+async def provenance(request: Request):
+    """
+    Scan the start of an image file (request body) for generator metadata
+    For clients that upload a downscaled copy, which loses the metadata:
+    200 with the metadata verdict when a generator is named, else 204.
+    Only the first 256KB are read; no decoding, no model.
+    """
+    head = bytearray()
+    async for chunk in request.stream():
+        head.extend(chunk[:PREFIX_SCAN_BYTES - len(head)])
+        if len(head) >= PREFIX_SCAN_BYTES:
+            break
+
+    if PROVENANCE_SCAN:
+        with stage("provenance"):
+            hit = scan_provenance(bytes(head))
+        if hit.source:
+            logger.debug("AI detected via %s metadata: %s", hit.field, hit.source)
+            result = metadata_response(hit.source, hit.field)
+            record_outcome("/provenance", result)
+            return with_timings(result)
+
+    return Response(status_code=204)
+
+async def detect_batch_item(index: int, item: BatchItem, use_ensemble: bool, ticket=None) -> dict:
+    """Detect one /detect/batch item; errors are reported per item"""
+    line = {"index": index, "id": item.id}
+    if ticket is not None:
+        current_ticket.set(ticket)  # This item's own task context
+
+    # Each item gets its own timings block (when the request asked for them)
+    with collect_timings(timings_requested()):
+        try:
+            if item.url:
+                line["url"] = item.url
+                result = await detect_url(item.url, use_ensemble=use_ensemble)
+                error = "Failed to download image"
+            elif item.image:
+                result = await run_inference(detect_base64_upload, item.image, use_ensemble=use_ensemble)
+                error = "Invalid or unsafe image"
+            else:
+                result = None
+                error = "Item needs a url or an image"
+
+            if result is None:
+                result = {
+                    "prediction": "error",
+                    "ai_probability": 0.0,
+                    "human_probability": 0.0,
+                    "error": error
+                }
+
+        except Exception as e:
+            logger.error("Batch item error: %s", e)
+            result = {
+                "prediction": "error",
+                "ai_probability": 0.0,
+                "human_probability": 0.0,
+                "error": str(e)
+            }
+
+        record_outcome("/detect/batch", result)
+        line.update(with_timings(result))
+    return line
+
+@app.post("/detect/batch")
+async def detect_batch(payload: BatchPayload, request: Request):
+    """
+    Detect many images (URLs and/or base64) in one request
+    Items are downloaded concurrently, share forward passes through the
+    inference batcher and are streamed back as NDJSON in completion order
+    The batch is admitted (or shed) as a whole on the bulk lane; its items
+    then queue for slots without being turned away, each with a deadline
+    that grows with the rounds of bulk slots ahead of it
+    """
+    require_ready()
+
+    if len(payload.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+
+    # The streamed response notices the client leaving and cancels the items
+    ticket = admit("bulk", request, shed=False, watch=False)
+
+    logger.debug("Processing batch of %d images...", len(payload.items))
+
+    async def stream():
+        tasks = [
+            asyncio.create_task(detect_batch_item(
+                index, item, payload.ensemble,
+                item_ticket(ticket, index, admission_control.bulk_slots) if ticket is not None else None
+            ))
+            for index, item in enumerate(payload.items)
+        ]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished) + "\n"
+        finally:
+            # Client went away: stop work nobody will read
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def scan_error(scan_id, status: int, error: str, retry_after=None) -> dict:
+    """/ws frame for a scan that was refused or dropped"""
+    frame = {"type": "error", "id": scan_id, "status": status, "error": error}
+    if retry_after is not None:
+        frame["retry_after"] = int(retry_after)
+    return frame
+
+async def run_scan(scan_id, message: dict, ticket) -> dict:
+    """Detect one /ws scan; returns the frame to send back"""
+    current_ticket.set(ticket)
+    use_ensemble = message.get("mode", "ensemble") != "fast"
+
+    with collect_timings(bool(message.get("timings"))):
+        try:
+            if message.get("url"):
+                result = await detect_url(message["url"], use_ensemble=use_ensemble)
+                error = "Failed to download image"
+            elif message.get("image"):
+                result = await run_inference(detect_base64_upload, message["image"], use_ensemble=use_ensemble)
+                error = "Invalid or unsafe image"
+            else:
+                result = None
+                error = "Scan needs a url or an image"
+
+            record_outcome("/ws", result)
+            if result is None:
+                result = {
+                    "prediction": "error",
+                    "ai_probability": 0.0,
+                    "human_probability": 0.0,
+                    "confidence": 0.0,
+                    "error": error
+                }
+            return dict(with_timings(result), type="result", id=scan_id)
+
+        except (Overloaded, Abandoned) as e:
+            record_outcome("/ws", None)
+            http_error = admission_error(e)
+            return scan_error(scan_id, http_error.status_code, http_error.detail, (http_error.headers or {}).get("Retry-After"))
+        except Exception as e:
+            logger.error("Scan error: %s", e)
+            record_outcome("/ws", None)
+            return scan_error(scan_id, 500, str(e))
+
+@app.websocket("/ws")
+async def scan_channel(websocket: WebSocket):
+    """
+    Long-lived scan channel: many scans multiplexed over one connection
+    Client frames (JSON):
+      {"type": "scan", "id": ..., "url" | "image": ..., "mode": "ensemble" | "fast",
+       "lane": "interactive" | "bulk", "deadline_ms": ..., "timings": bool}
+      {"type": "cancel", "id": ...}    drop a scan nobody needs any more
+      {"type": "ping"}
+    Server frames, pushed as each scan finishes (in any order):
+      {"type": "result", "id": ..., <detection>}
+      {"type": "error", "id": ..., "status": 429 | 503 | ..., "error": ..., "retry_after": ...}
+      {"type": "cancelled", "id": ...}, {"type": "pong"}
+    Scans go through the same cache, coalescing and admission lanes as the
+    HTTP endpoints. A cancelled scan (or every scan, when the connection
+    closes) has its ticket marked, so queued work is dropped before inference.
+    """
+    await websocket.accept()
+    scans = {}  # id -> (task, ticket)
+    send_lock = asyncio.Lock()
+
+    async def send(frame: dict):
+        async with send_lock:
+            await websocket.send_text(json.dumps(frame))
+
+    async def scan_and_reply(scan_id, message, ticket):
+        frame = await run_scan(scan_id, message, ticket)
+        if scans.pop(scan_id, None) is None:
+            return  # Cancelled while it ran; the client already got "cancelled"
+        try:
+            await send(frame)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+
+    def cancel(scan_id) -> bool:
+        entry = scans.pop(scan_id, None)
+        if entry is None:
+            return False
+        task, ticket = entry
+        if ticket is not None:
+            ticket.cancelled = True  # Reaches work shared with coalesced requests too
+        task.cancel()
+        return True
+
+    WS_CONNECTIONS.inc()
+    try:
+        await send({"type": "hello", "version": "2.0-enhanced", "ready": is_ready()})
+
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                kind = message.get("type")
+                scan_id = message.get("id")
+            except (ValueError, AttributeError):
+                await send(scan_error(None, 400, "Frames must be JSON objects"))
+                continue
+            if not isinstance(scan_id, (str, int, type(None))):
+                await send(scan_error(None, 400, "Scan ids must be strings or numbers"))
+                continue
+
+            if kind == "ping":
+                await send({"type": "pong"})
+                continue
+
+            if kind == "cancel":
+                if cancel(scan_id):
+                    await send({"type": "cancelled", "id": scan_id})
+                continue
+
+            if kind != "scan":
+                await send(scan_error(scan_id, 400, f"Unknown frame type: {kind}"))
+                continue
+
+            lane = message.get("lane", "interactive")
+            if scan_id is None or scan_id in scans:
+                await send(scan_error(scan_id, 400, "Each scan needs an id not already in flight"))
+                continue
+            if lane not in LANES:
+                await send(scan_error(scan_id, 400, f"Unknown lane: {lane}"))
+                continue
+            if not is_ready():
+                await send(scan_error(scan_id, 503, f"Model not ready ({get_model_status()['phase']})", 5))
+                continue
+            if len(scans) >= WS_MAX_IN_FLIGHT:
+                await send(scan_error(scan_id, 429, "Too many scans in flight on this connection", 1))
+                continue
+
+            ticket = None
+            if ADMISSION_ENABLED:
+                try:
+                    admission_control.check(lane)
+                except Overloaded as e:
+                    await send(scan_error(scan_id, e.status, str(e), e.retry_after))
+                    continue
+                # Once accepted, bulk scans wait for a slot like /detect/batch items
+                ticket = lane_ticket(lane, message.get("deadline_ms"), shed=lane != "bulk")
+
+            task = asyncio.create_task(scan_and_reply(scan_id, message, ticket))
+            scans[scan_id] = (task, ticket)
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        WS_CONNECTIONS.dec()
+        for scan_id in list(scans):
+            cancel(scan_id)
+
 if __name__ == "__main__":
     import uvicorn
     print("\n" + "="*60)
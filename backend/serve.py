@@ -0,0 +1,203 @@
+"""
+Multi-core pre-fork server for the Shield backend
+
+The parent loads the processor and SigLIP weights once, binds the listening
+socket and forks the workers. Weight tensors are only ever read, so every
+worker shares the parent's pages copy-on-write instead of holding its own
+copy, and starts warm. Each worker gets its own slice of the CPU for torch
+intra-op threads so the workers don't oversubscribe the machine.
+
+Usage: python serve.py [--workers N] [--threads-per-worker T] [--host H] [--port P]
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.logs import configure_logging, logger
+from utils.tuning import apply_profile
+
+# ----------------------------------------------------
+# SERVING CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# Worker processes (0 = one per 2 cores)
+WORKERS = int(os.environ.get("SHIELD_WORKERS", "0"))
+
+# torch intra-op threads per worker (0 = available cores / workers)
+THREADS_PER_WORKER = int(os.environ.get("SHIELD_THREADS_PER_WORKER", "0"))
+
+# Pin each worker to its own disjoint set of cores (Linux only)
+PIN_CPUS = os.environ.get("SHIELD_PIN_CPUS", "0") == "1"
+
+# Seconds between respawns of a worker that keeps dying
+RESPAWN_DELAY = 1.0
+
+# ----------------------------------------------------
+# CPU LAYOUT
+# ----------------------------------------------------
+
+def available_cpus() -> list:
+    """Cores this process may run on (respects taskset/cgroup cpusets)"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def plan_workers(workers: int, threads: int) -> list:
+    """Core set for each worker: contiguous, disjoint slices of the available cores"""
+    cpus = available_cpus()
+    workers = workers or max(1, len(cpus) // 2)
+    threads = threads or max(1, len(cpus) // workers)
+
+    plan = []
+    for index in range(workers):
+        start = (index * threads) % len(cpus)
+        plan.append([cpus[(start + offset) % len(cpus)] for offset in range(threads)])
+    return plan
+
+# ----------------------------------------------------
+# WORKER PROCESS
+# ----------------------------------------------------
+
+def run_worker(index: int, cores: list, sock: socket.socket, args):
+    """Child side of the fork: size the thread pools, then serve on the shared socket"""
+    import torch
+    import uvicorn
+
+    if PIN_CPUS and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    torch.set_num_threads(len(cores))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already fixed for this process
+        pass
+
+    # Preprocessing threads scale with the worker's share, not the whole machine
+    os.environ.setdefault("SHIELD_INFERENCE_WORKERS", str(max(2, 2 * len(cores))))
+
+    logger.info("Worker %s (pid %s): %s threads%s", index, os.getpid(), len(cores),
+                f", cores {cores}" if PIN_CPUS else "")
+
+    config = uvicorn.Config("main:app", log_level=args.log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+def spawn_worker(index: int, cores: list, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            run_worker(index, cores, sock, args)
+        except BaseException as e:
+            logger.error("Worker %s crashed: %s", index, e)
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+# ----------------------------------------------------
+# PARENT / SUPERVISOR
+# ----------------------------------------------------
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def preload_model():
+    """Load weights in the parent without running anything that starts thread pools"""
+    import torch
+
+    # One thread until the fork: OpenMP pools created here would be
+    # unusable in the children
+    torch.set_num_threads(1)
+
+    from utils import detector
+
+    # onnxruntime sessions hold native threads, so that engine is built
+    # per worker; torch/int8 engines are plain modules and are shared
+    detector.load_model(with_engine=detector.ENGINE != "onnx")
+
+def main():
+    parser = argparse.ArgumentParser(description="Shield backend with pre-forked workers sharing one copy of the model")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--threads-per-worker", type=int, default=THREADS_PER_WORKER)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    configure_logging()
+
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs os.fork(); use `uvicorn main:app` on this platform")
+
+    # Workers size their torch pools from the CPU plan rather than from a
+    # tuning profile (which still supplies the batching settings).
+    # Explicitly set variables win, as everywhere else.
+    for variable in ("SHIELD_TORCH_THREADS", "SHIELD_INTEROP_THREADS"):
+        if variable in os.environ:
+            logger.info("%s=%s set explicitly; used by every worker", variable, os.environ[variable])
+        else:
+            os.environ[variable] = "0"
+    apply_profile()
+
+    plan = plan_workers(args.workers, args.threads_per_worker)
+    sock = bind_socket(args.host, args.port)
+
+    started = time.perf_counter()
+    preload_model()
+    logger.info("Weights loaded in parent in %.1fs, forking %s workers on %s:%s",
+                time.perf_counter() - started, len(plan), args.host, args.port)
+
+    workers = {}
+    for index, cores in enumerate(plan):
+        workers[spawn_worker(index, cores, sock, args)] = index
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # Reap workers; replace any that die while we're still serving
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+
+        logger.info("Worker %s (pid %s) exited with status %s, respawning", index, pid, status)
+        time.sleep(RESPAWN_DELAY)
+        workers[spawn_worker(index, plan[index], sock, args)] = index
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
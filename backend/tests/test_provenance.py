@@ -0,0 +1,95 @@
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.provenance import scan_image_info, scan_provenance
+
+def jpeg_with(marker: int, payload: bytes) -> bytes:
+    """A JPEG prefix holding one metadata segment, followed by start of scan"""
+    segment = bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, "big") + payload
+    return b"\xff\xd8" + segment + b"\xff\xda\x00\x02"
+
+def png_with(**text) -> bytes:
+    info = PngInfo()
+    for key, value in text.items():
+        info.add_text(key, value)
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, "PNG", pnginfo=info)
+    return buffer.getvalue()
+
+def jpeg_with_exif(tag: int, value: str) -> bytes:
+    exif = Image.Exif()
+    exif[tag] = value
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+def xmp_with_creator_tool(tool: str) -> bytes:
+    xmp = (
+        b"http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta><rdf:Description xmp:CreatorTool=\""
+        + tool.encode() + b"\"/></x:xmpmeta>"
+    )
+    return jpeg_with(0xE1, xmp)
+
+# ----------------------------------------------------
+# GENERIC WORDS IN FREE TEXT
+# ----------------------------------------------------
+
+@pytest.mark.parametrize("caption", [
+    "Una imagen de la playa",
+    "heat flux measurement plot",
+    "Firefly squadron at dusk",
+    "Flux capacitor, imagen 2x zoom",
+    "Imagen 2 de 10: vista del puerto",
+    "Figura 3. Imagen 1 muestra"
+])
+def test_captions_are_not_generators(caption):
+    assert scan_provenance(jpeg_with(0xFE, caption.encode())).source is None
+    assert scan_provenance(png_with(Description=caption)).source is None
+    assert scan_provenance(jpeg_with_exif(0x010E, caption)).source is None
+    assert scan_image_info({"Description": caption}) is None
+
+@pytest.mark.parametrize("caption, source", [
+    ("Made with Google Imagen", "Imagen"),
+    ("FLUX.1 [dev] render", "Flux"),
+    ("Generated by Adobe Firefly", "Firefly"),
+    ("midjourney --v 6", "Midjourney")
+])
+def test_qualified_names_in_free_text(caption, source):
+    assert scan_provenance(jpeg_with(0xFE, caption.encode())).source == source
+
+# ----------------------------------------------------
+# GENERATOR FIELDS
+# ----------------------------------------------------
+
+@pytest.mark.parametrize("software, source", [
+    ("Flux", "Flux"),
+    ("Imagen", "Imagen"),
+    ("Imagen3", "Imagen"),
+    ("Firefly", "Firefly"),
+    ("Adobe Photoshop 25.0", None)
+])
+def test_exif_software(software, source):
+    hit = scan_provenance(jpeg_with_exif(0x0131, software))
+    assert hit.source == source
+    if source:
+        assert hit.field == "exif"
+
+def test_xmp_creator_tool():
+    assert scan_provenance(xmp_with_creator_tool("Flux")).source == "Flux"
+    assert scan_provenance(xmp_with_creator_tool("GIMP 2.10")).source is None
+
+def test_png_software_chunk():
+    assert scan_provenance(png_with(Software="Imagen")).source == "Imagen"
+
+def test_c2pa_software_agent():
+    agent = b"Flux"
+    claim = b"softwareAgent" + bytes([0x60 + len(agent)]) + agent + b"dc:title" + b"\x6aheat flux!"
+    assert scan_provenance(jpeg_with(0xEB, claim)).source == "Flux"
+    assert scan_provenance(jpeg_with(0xEB, b"dc:title\x6aheat flux!")).source is None
@@ -0,0 +1,229 @@
+"""
+Find the fastest torch thread and batching settings for this machine
+
+Usage:
+    python tools/autotune.py [--engine torch|int8|onnx|stub] [--seconds 3] [--concurrency N]
+                             [--threads 1,2,4] [--interop 1,2] [--batch-sizes 1,4,8,16,32]
+                             [--waits 0,2,5,10,20] [--max-p95-ms 800] [--out PATH] [--dry-run]
+
+Every thread layout (intra-op x inter-op threads) runs in its own
+subprocess, because torch fixes the inter-op pool once per process. The
+subprocess loads the model, then tries each batch size / batching wait
+combination under a synthetic load: --concurrency client threads (by
+default as many as the server's inference threads) run images through
+the same path as /detect (enhance, preprocess, batched forward passes,
+the adaptive ensemble) for --seconds each.
+
+The winner is the setting with the highest throughput whose p95 latency
+stays within --max-p95-ms (default: twice the best p95 seen). It is saved
+as the tuning profile (SHIELD_PROFILE, default ~/.cache/shield/tuning.json)
+that the server loads at boot and reports under "tuning_profile" in
+/config. SHIELD_* variables set explicitly still override the profile, and
+a profile made for a different CPU budget or engine is ignored.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Make backend modules importable when run from anywhere
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+from bench import percentile, synthetic_photo
+from utils.tuning import PROFILE_PATH, machine_fingerprint, save_profile, usable_cpus
+
+# (width, height) of the synthetic images each client cycles through
+LOAD_SIZES = [(640, 480), (1024, 768), (1280, 720), (800, 800), (1920, 1080), (480, 640)]
+
+# Untimed seconds before each measurement, so the batcher settles on the new limits
+SETTLE_SECONDS = 0.5
+
+# ----------------------------------------------------
+# TRIAL (runs in a subprocess per thread layout)
+# ----------------------------------------------------
+
+def run_trial(spec: dict) -> dict:
+    """Load the model with this process's thread layout and measure every batching setting"""
+    import numpy as np
+    from utils import detector
+
+    detector.start_model()
+    if not detector.is_ready():
+        raise RuntimeError(f"Model failed to load: {detector.get_model_status()['error']}")
+
+    rng = np.random.default_rng(0)
+    images = [synthetic_photo(width, height, rng) for width, height in LOAD_SIZES]
+
+    results = []
+    for batch_size, wait_ms in spec["grid"]:
+        detector.batcher.configure(max_batch_size=batch_size, max_wait_ms=wait_ms)
+        run = drive_load(detector, images, spec["concurrency"], spec["seconds"])
+        run.update(batch_max_size=batch_size, batch_max_wait_ms=wait_ms)
+        results.append(run)
+
+    return {"threads": detector.get_detector_config()["torch_threads"], "results": results}
+
+def drive_load(detector, images: list, concurrency: int, seconds: float) -> dict:
+    """concurrency threads detecting images back to back; latency/throughput of the timed part"""
+    latencies = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    measure_from = started + SETTLE_SECONDS
+    stop_at = measure_from + seconds
+
+    def client(offset: int):
+        index = offset
+        while True:
+            begin = time.perf_counter()
+            if begin >= stop_at:
+                return
+            detector.detect_ai_image(images[index % len(images)], check_metadata=False)
+            end = time.perf_counter()
+            index += 1
+            if begin >= measure_from and end <= stop_at:
+                with lock:
+                    latencies.append((end - begin) * 1000.0)
+
+    threads = [threading.Thread(target=client, args=(offset,), daemon=True) for offset in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        "images": len(latencies),
+        "throughput_ips": round(len(latencies) / seconds, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2)
+    }
+
+# ----------------------------------------------------
+# SWEEP (parent process)
+# ----------------------------------------------------
+
+def run_layout(args, torch_threads: int, interop_threads: int, grid: list) -> list:
+    """Run one thread layout in a fresh interpreter; its results, tagged with the layout"""
+    env = dict(
+        os.environ,
+        SHIELD_ENGINE=args.engine,
+        SHIELD_TORCH_THREADS=str(torch_threads),
+        SHIELD_INTEROP_THREADS=str(interop_threads),
+        SHIELD_PROFILE="",  # Measure from scratch, not on top of an older profile
+        SHIELD_NEAR_DUP="0",  # Repeated images would all be answered from the index
+        SHIELD_LOG_LEVEL="ERROR"
+    )
+    spec = {"grid": grid, "concurrency": args.concurrency, "seconds": args.seconds}
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--trial", json.dumps(spec)],
+        env=env, stdout=subprocess.PIPE, text=True
+    )
+    if completed.returncode != 0:
+        print(f"[autotune] threads={torch_threads} interop={interop_threads} failed "
+              f"(exit {completed.returncode})", file=sys.stderr)
+        return []
+
+    trial = json.loads(completed.stdout.strip().splitlines()[-1])
+    if trial["threads"] != torch_threads:
+        print(f"[autotune] asked for {torch_threads} threads, got {trial['threads']}", file=sys.stderr)
+
+    runs = []
+    for run in trial["results"]:
+        run.update(torch_threads=torch_threads, interop_threads=interop_threads)
+        runs.append(run)
+        print(
+            f"[autotune] threads={torch_threads:<2} interop={interop_threads:<2} "
+            f"batch={run['batch_max_size']:<3} wait={run['batch_max_wait_ms']:<4}ms "
+            f"{run['throughput_ips']:7.1f} img/s  p50={run['p50_ms']:.1f}ms p95={run['p95_ms']:.1f}ms",
+            file=sys.stderr
+        )
+    return runs
+
+def pick_best(runs: list, max_p95_ms: float = None) -> dict:
+    """Highest throughput within the p95 budget (default: twice the best p95 seen)"""
+    measured = [run for run in runs if run["images"] > 0]
+    if not measured:
+        return None
+    budget = max_p95_ms or 2 * min(run["p95_ms"] for run in measured)
+    eligible = [run for run in measured if run["p95_ms"] <= budget] or measured
+    return max(eligible, key=lambda run: (run["throughput_ips"], -run["p95_ms"]))
+
+def int_list(text: str) -> list:
+    return sorted({int(value) for value in text.split(",") if value.strip()})
+
+def float_list(text: str) -> list:
+    return sorted({float(value) for value in text.split(",") if value.strip()})
+
+def default_threads(cpus: int) -> str:
+    """Powers of two up to the usable cores, plus the core count itself"""
+    counts = {cpus}
+    count = 1
+    while count < cpus:
+        counts.add(count)
+        count *= 2
+    return ",".join(str(count) for count in sorted(counts))
+
+def main():
+    cpus = usable_cpus()
+
+    parser = argparse.ArgumentParser(description="Measure the best torch thread and batching settings for this machine")
+    parser.add_argument("--engine", default=os.environ.get("SHIELD_ENGINE", "torch"))
+    parser.add_argument("--seconds", type=float, default=3.0, help="measured seconds per setting")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("SHIELD_INFERENCE_WORKERS", str(max(4, os.cpu_count() or 1)))),
+                        help="concurrent requests (default: the server's inference threads)")
+    parser.add_argument("--threads", default=default_threads(cpus), help="intra-op thread counts to try")
+    parser.add_argument("--interop", default="1,2" if cpus > 1 else "1", help="inter-op thread counts to try")
+    parser.add_argument("--batch-sizes", default="1,4,8,16,32")
+    parser.add_argument("--waits", default="0,2,5,10,20", help="batching windows to try (ms)")
+    parser.add_argument("--max-p95-ms", type=float, default=None)
+    parser.add_argument("--out", default=PROFILE_PATH or os.path.join(os.path.expanduser("~"), ".cache", "shield", "tuning.json"))
+    parser.add_argument("--dry-run", action="store_true", help="report the winner without saving a profile")
+    parser.add_argument("--trial", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial:
+        print(json.dumps(run_trial(json.loads(args.trial))))
+        return
+
+    grid = [(size, wait) for size in int_list(args.batch_sizes) for wait in float_list(args.waits)]
+    layouts = [(threads, interop) for threads in int_list(args.threads) for interop in int_list(args.interop)]
+    print(f"[autotune] {len(layouts)} thread layouts x {len(grid)} batch settings, "
+          f"{args.concurrency} concurrent requests, {cpus} usable cores, engine {args.engine}", file=sys.stderr)
+
+    runs = []
+    for threads, interop in layouts:
+        runs.extend(run_layout(args, threads, interop, grid))
+
+    best = pick_best(runs, args.max_p95_ms)
+    if best is None:
+        sys.exit("[autotune] no setting completed a measurement")
+
+    settings = {
+        "torch_threads": best["torch_threads"],
+        "interop_threads": best["interop_threads"],
+        "batch_max_size": best["batch_max_size"],
+        "batch_max_wait_ms": best["batch_max_wait_ms"]
+    }
+    print(f"[autotune] best: {json.dumps(settings)} -> {best['throughput_ips']} img/s, "
+          f"p95 {best['p95_ms']}ms", file=sys.stderr)
+
+    if args.dry_run:
+        return
+
+    from utils.detector import MODEL_ID
+    model = "stub" if args.engine == "stub" else MODEL_ID
+    save_profile(args.out, settings, machine_fingerprint(args.engine, model), extra={
+        "load": {"concurrency": args.concurrency, "seconds": args.seconds, "max_p95_ms": args.max_p95_ms},
+        "best": best,
+        "results": runs
+    })
+    print(f"[autotune] profile written to {args.out}; restart the server to use it", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
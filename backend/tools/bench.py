@@ -0,0 +1,461 @@
+"""
+Offline benchmark for the detection pipeline
+
+Usage:
+    python tools/bench.py [--requests 40] [--concurrency 1,4,16] [--scenarios detect,detect_fast,upload,upload_raw]
+                          [--engine stub|torch|int8|onnx] [--url http://127.0.0.1:8000 [--server-pid PID]]
+                          [--out bench.json] [--baseline previous.json]
+
+Generates a reproducible corpus of images in several sizes and formats,
+including EXIF-tagged ones that take the metadata path, and serves them
+from a local HTTP server that stands in for image hosts. Each scenario
+(/detect, /detect/fast, /upload, /upload/raw) is driven by N concurrent
+clients against the app in-process, or against a running server with
+--url. For every
+scenario and concurrency level it reports p50/p95/p99 latency, throughput
+and the per-stage breakdown from the opt-in timings block, plus the
+server's peak RSS over its footprint before start (in-process, or
+--server-pid with --url).
+
+The default "stub" engine needs no model weights, so the harness runs
+anywhere; pass --engine torch to benchmark the real model. The result
+cache is disabled in-process so every request runs the pipeline (start
+an external server with SHIELD_CACHE_ENABLED=0 for the same effect).
+"""
+
+import argparse
+import asyncio
+import base64
+import gc
+import http.server
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+# Make backend modules importable when run from anywhere
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+CORPUS_VERSION = 1
+
+# (width, height, format) of the generated corpus
+CORPUS_SPECS = [
+    (320, 240, "JPEG"),
+    (800, 600, "JPEG"),
+    (1920, 1080, "JPEG"),
+    (4032, 3024, "JPEG"),
+    (640, 480, "PNG"),
+    (1280, 720, "PNG"),
+    (800, 800, "WEBP"),
+    (1600, 1200, "WEBP"),
+]
+
+# EXIF-tagged JPEGs that the metadata check short-circuits: (width, height, tag, value)
+EXIF_SPECS = [
+    (1024, 768, 0x0131, "Midjourney v6"),       # Software
+    (1024, 1024, 0x010e, "Made with Stable Diffusion XL"),  # ImageDescription
+]
+
+SCENARIOS = {
+    "detect": "/detect",
+    "detect_fast": "/detect/fast",
+    "upload": "/upload",
+    "upload_raw": "/upload/raw",
+}
+
+# Largest file the upload scenarios will send (the endpoints' own cap is 10MB)
+UPLOAD_MAX_BYTES = 9 * 1024 * 1024
+
+# ----------------------------------------------------
+# CORPUS
+# ----------------------------------------------------
+
+def synthetic_photo(width: int, height: int, rng) -> Image.Image:
+    """Smooth gradients, a few shapes and mild sensor-like noise; compresses like a photo"""
+    ys = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None]
+    xs = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :]
+    phase = rng.uniform(0, 2 * np.pi, size=3)
+    freq = rng.uniform(2, 8, size=3)
+
+    channels = []
+    for c in range(3):
+        wave = np.sin(freq[c] * (xs + ys * 0.6) * np.pi + phase[c])
+        channels.append(110 + 80 * wave + 40 * (xs - ys))
+    pixels = np.stack(channels, axis=-1)
+
+    for _ in range(4):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        radius = rng.uniform(0.05, 0.25) * min(width, height)
+        mask = ((np.arange(width)[None, :] - cx) ** 2 + (np.arange(height)[:, None] - cy) ** 2) < radius ** 2
+        pixels[mask] = rng.uniform(0, 255, size=3)
+
+    pixels += rng.normal(0, 4, size=pixels.shape).astype(np.float32)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+
+def generate_corpus(corpus_dir: str, seed: int) -> list:
+    """Write the corpus (or reuse an identical earlier one) and return its manifest"""
+    manifest_path = os.path.join(corpus_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == CORPUS_VERSION and manifest.get("seed") == seed:
+            return manifest["images"]
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    images = []
+
+    def save(img, name, fmt, exif=None):
+        path = os.path.join(corpus_dir, name)
+        options = {"quality": 90} if fmt in ("JPEG", "WEBP") else {}
+        if exif is not None:
+            options["exif"] = exif
+        img.save(path, fmt, **options)
+        images.append({
+            "name": name,
+            "width": img.width,
+            "height": img.height,
+            "format": fmt,
+            "bytes": os.path.getsize(path),
+            "ai_metadata": exif is not None
+        })
+
+    for width, height, fmt in CORPUS_SPECS:
+        ext = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}[fmt]
+        save(synthetic_photo(width, height, rng), f"{width}x{height}.{ext}", fmt)
+
+    for width, height, tag, value in EXIF_SPECS:
+        exif = Image.Exif()
+        exif[tag] = value
+        save(synthetic_photo(width, height, rng), f"exif-{width}x{height}.jpg", "JPEG", exif=exif)
+
+    with open(manifest_path, "w") as f:
+        json.dump({"version": CORPUS_VERSION, "seed": seed, "images": images}, f, indent=2)
+    return images
+
+# ----------------------------------------------------
+# LOCAL IMAGE HOST
+# ----------------------------------------------------
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    extensions_map = dict(
+        http.server.SimpleHTTPRequestHandler.extensions_map,
+        **{".webp": "image/webp", ".jpg": "image/jpeg", ".png": "image/png"}
+    )
+
+    def log_message(self, *args):
+        pass
+
+def start_image_host(corpus_dir: str):
+    """Serve the corpus on a free localhost port; returns (server, base_url)"""
+    handler = lambda *a, **kw: _QuietHandler(*a, directory=corpus_dir, **kw)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="bench-image-host", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# ----------------------------------------------------
+# MEASUREMENT
+# ----------------------------------------------------
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+def summarize(values_ms: list) -> dict:
+    values = sorted(values_ms)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50), 3),
+        "p95_ms": round(percentile(values, 0.95), 3),
+        "p99_ms": round(percentile(values, 0.99), 3),
+        "max_ms": round(values[-1], 3) if values else 0.0
+    }
+
+def current_rss_mb(pid="self"):
+    """Resident memory of a process right now (None where /proc isn't available)"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+class RssSampler:
+    """
+    Peak resident memory of a process while the benchmark runs
+    ru_maxrss can't be used: it is process-wide since start, so it would
+    include corpus generation (and, in-process, the clients). This samples
+    current RSS from a baseline taken just before the server starts.
+    """
+
+    INTERVAL = 0.1
+
+    def __init__(self, pid="self"):
+        self.pid = pid
+        self.baseline = current_rss_mb(pid)
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        if self.baseline is not None:
+            self._thread.start()
+        return self
+
+    def stop(self) -> dict:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        if self.baseline is None:
+            return {"pid": self.pid, "baseline_rss_mb": None, "peak_rss_mb": None, "peak_delta_mb": None}
+        return {
+            "pid": self.pid,
+            "baseline_rss_mb": round(self.baseline, 1),
+            "peak_rss_mb": round(self.peak, 1),
+            "peak_delta_mb": round(self.peak - self.baseline, 1)
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.INTERVAL):
+            rss = current_rss_mb(self.pid)
+            if rss is None:
+                return  # Process gone
+            self.peak = max(self.peak, rss)
+
+def build_requests(scenario: str, corpus: list, corpus_dir: str, host_url: str) -> list:
+    """One request (httpx keyword arguments) per corpus image for the scenario"""
+    payloads = []
+    for image in corpus:
+        if scenario in ("upload", "upload_raw"):
+            if image["bytes"] > UPLOAD_MAX_BYTES:
+                continue
+            with open(os.path.join(corpus_dir, image["name"]), "rb") as f:
+                content = f.read()
+            mime = "image/" + {"JPEG": "jpeg", "PNG": "png", "WEBP": "webp"}[image["format"]]
+
+            if scenario == "upload_raw":
+                payloads.append({"content": content, "headers": {"Content-Type": mime}})
+            else:
+                encoded = base64.b64encode(content).decode()
+                payloads.append({"json": {"image": f"data:{mime};base64,{encoded}"}})
+        else:
+            payloads.append({"json": {"url": f"{host_url}/{image['name']}"}})
+    return payloads
+
+async def run_load(client, path: str, payloads: list, total: int, concurrency: int) -> dict:
+    """Send total requests (cycling through payloads) from concurrency clients"""
+    latencies, stages, outcomes = [], {}, {}
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < total:
+            payload = payloads[next_index % len(payloads)]
+            next_index += 1
+            headers = dict(payload.get("headers") or {}, **{"X-Shield-Timings": "1"})
+
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, **dict(payload, headers=headers))
+                body = response.json()
+            except Exception:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+            if response.status_code != 200 or body.get("prediction") == "error":
+                errors += 1
+                continue
+
+            outcome = "metadata" if body.get("method") == "metadata" else body.get("prediction")
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            for name, ms in (body.get("timings") or {}).items():
+                stages.setdefault(name, []).append(ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency": summarize(latencies),
+        "outcomes": outcomes,
+        "stages": {name: summarize(values) for name, values in sorted(stages.items())}
+    }
+
+# ----------------------------------------------------
+# DRIVER
+# ----------------------------------------------------
+
+async def wait_ready(client, timeout=600.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not become ready")
+
+async def run_benchmark(args, corpus: list, host_url: str) -> dict:
+    import httpx
+
+    results = {}
+
+    async def drive(client):
+        await wait_ready(client)
+        for scenario in args.scenarios:
+            payloads = build_requests(scenario, corpus, args.corpus, host_url)
+            path = SCENARIOS[scenario]
+
+            # One untimed pass so first-request costs don't land in the numbers
+            await run_load(client, path, payloads, len(payloads), 1)
+
+            results[scenario] = []
+            for concurrency in args.concurrency:
+                run = await run_load(client, path, payloads, args.requests, concurrency)
+                results[scenario].append(run)
+                print(
+                    f"[bench] {scenario:<12} c={concurrency:<3} p50={run['latency']['p50_ms']:.1f}ms "
+                    f"p95={run['latency']['p95_ms']:.1f}ms p99={run['latency']['p99_ms']:.1f}ms "
+                    f"{run['throughput_rps']:.1f} req/s errors={run['errors']}",
+                    file=sys.stderr
+                )
+
+    timeout = httpx.Timeout(120.0)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            await drive(client)
+    else:
+        import main
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://shield", timeout=timeout) as client:
+                await drive(client)
+
+    return results
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+def compare_with_baseline(report: dict, baseline_path: str):
+    """Print p50/p95/throughput change against an earlier report"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def change(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    for scenario, runs in report["scenarios"].items():
+        previous = {run["concurrency"]: run for run in baseline.get("scenarios", {}).get(scenario, [])}
+        for run in runs:
+            old = previous.get(run["concurrency"])
+            if old is None:
+                continue
+            print(
+                f"[bench] vs baseline {scenario:<12} c={run['concurrency']:<3} "
+                f"p50 {change(run['latency']['p50_ms'], old['latency']['p50_ms'])} "
+                f"p95 {change(run['latency']['p95_ms'], old['latency']['p95_ms'])} "
+                f"throughput {change(run['throughput_rps'], old['throughput_rps'])}",
+                file=sys.stderr
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Shield detection pipeline offline")
+    parser.add_argument("--corpus", default=os.path.join(os.path.expanduser("~"), ".cache", "shield", "bench-corpus"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=40, help="requests per scenario and concurrency level")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--engine", default="stub", help="SHIELD_ENGINE for the in-process app")
+    parser.add_argument("--url", default=None, help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--server-pid", type=int, default=None, help="with --url, the server's pid to measure its memory")
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--baseline", default=None, help="earlier report to compare against")
+    args = parser.parse_args()
+
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    args.scenarios = [s for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {unknown}")
+
+    # The app reads these at import time
+    os.environ["SHIELD_ENGINE"] = args.engine
+    os.environ.setdefault("SHIELD_CACHE_ENABLED", "0")
+    os.environ.setdefault("SHIELD_LOG_LEVEL", "WARNING")
+
+    corpus = generate_corpus(args.corpus, args.seed)
+    host, host_url = start_image_host(args.corpus)
+
+    # In-process, the baseline is taken after the corpus is generated and
+    # before the app (and model) is imported, so the delta is the server's
+    # (plus the small client side); with --url it needs --server-pid
+    gc.collect()
+    pid = args.server_pid if args.url else "self"
+    memory = RssSampler(pid).start() if pid is not None else None
+
+    try:
+        scenarios = asyncio.run(run_benchmark(args, corpus, host_url))
+    finally:
+        host.shutdown()
+        memory = memory.stop() if memory is not None else None
+
+    import torch
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git": git_revision(),
+            "engine": None if args.url else args.engine,
+            "target": args.url or "in-process",
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "requests": args.requests,
+            "seed": args.seed
+        },
+        "corpus": corpus,
+        "scenarios": scenarios,
+        "memory": memory
+    }
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    if memory and memory["peak_rss_mb"] is not None:
+        print(f"[bench] server peak RSS {memory['peak_rss_mb']} MB "
+              f"(+{memory['peak_delta_mb']} MB over {memory['baseline_rss_mb']} MB before start)", file=sys.stderr)
+    print(f"[bench] report written to {args.out}", file=sys.stderr)
+
+    if args.baseline:
+        compare_with_baseline(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
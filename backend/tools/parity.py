@@ -0,0 +1,165 @@
+"""
+Compare fast paths against the reference pipeline
+
+Usage:
+    python tools/parity.py IMAGE_DIR [--engines int8,onnx] [--batch-size 8] [--limit 200]
+
+Runs every image through the fp32 reference and each candidate engine and
+reports probability drift, label flips and median forward latency, so a
+faster engine's speed-up can be weighed against any accuracy loss.
+Also reports how far the fast preprocessor's pixel_values are from the
+HF image processor's on the same images, the error of the subsampled
+image_analysis statistics against the exact full-resolution ones, and
+how far the tensor-space ensemble variants are from building each
+variant in PIL at full resolution and preprocessing it again.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import torch
+from PIL import Image, ImageEnhance
+
+# Make backend modules importable when run from anywhere
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import detector
+from utils.engines import TorchEngine, create_engine, time_engine
+from utils.preprocess import ENSEMBLE_VARIANTS, ROTATE_DEGREES, ZOOM_CROP, BRIGHTNESS_FACTOR, compare_with_processor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif")
+
+
+def load_images(image_dir: str, limit: int) -> list:
+    paths = []
+    for root, _, files in os.walk(image_dir):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    paths = sorted(paths)[:limit]
+
+    images = []
+    for path in paths:
+        try:
+            images.append(Image.open(path).convert("RGB"))
+        except Exception as e:
+            print(f"[Shield] Skipping {path}: {e}")
+    return images
+
+
+def ai_probs(engine, pixel_values: torch.Tensor, batch_size: int) -> torch.Tensor:
+    ai_index = detector.model.config.label2id["ai"]
+    out = []
+    for start in range(0, len(pixel_values), batch_size):
+        logits = engine.logits(pixel_values[start:start + batch_size])
+        out.append(torch.softmax(logits, dim=-1)[:, ai_index])
+    return torch.cat(out)
+
+
+def analysis_report(images: list) -> dict:
+    errors = [detector.compare_analysis(img) for img in images]
+    return {
+        "max_contrast_error": max(e["contrast_error"] for e in errors),
+        "max_saturation_error": max(e["saturation_error"] for e in errors),
+        "high_contrast_decisions_changed": sum(1 for e in errors if e["high_contrast_changed"])
+    }
+
+
+def pil_variants(img: Image.Image) -> list:
+    """The ensemble variants built the old way: full-size PIL copies"""
+    w, h = img.size
+    crop_box = (int(w * ZOOM_CROP), int(h * ZOOM_CROP), int(w * (1 - ZOOM_CROP)), int(h * (1 - ZOOM_CROP)))
+    return [
+        img,
+        img.rotate(ROTATE_DEGREES, expand=False, fillcolor=(255, 255, 255)),
+        img.crop(crop_box).resize((w, h), Image.LANCZOS),
+        ImageEnhance.Brightness(img).enhance(BRIGHTNESS_FACTOR),
+    ]
+
+
+def augmentation_report(engine, images: list, batch_size: int) -> dict:
+    """Tensor-space ensemble variants against PIL-built ones: pixel and ai-probability drift"""
+    pixel_diffs, prob_diffs = [], []
+    for img in images:
+        prepared = detector.prepare_image(img)
+        reference = detector.preprocess_images(pil_variants(prepared))
+        candidate = detector.fast_preprocessor.augment(
+            detector.preprocess_images([prepared]), ENSEMBLE_VARIANTS, aspect=prepared.width / prepared.height
+        )
+        pixel_diffs.append((candidate - reference).abs().flatten(1).mean(1))
+        prob_diffs.append((ai_probs(engine, candidate, batch_size) - ai_probs(engine, reference, batch_size)).abs())
+
+    pixel_diffs = torch.stack(pixel_diffs)
+    prob_diffs = torch.stack(prob_diffs)
+    return {
+        variant: {
+            "mean_abs_pixel_diff": float(pixel_diffs[:, i].mean()),
+            "max_abs_prob_diff": float(prob_diffs[:, i].max()),
+            "mean_abs_prob_diff": float(prob_diffs[:, i].mean())
+        }
+        for i, variant in enumerate(ENSEMBLE_VARIANTS)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image_dir")
+    parser.add_argument("--engines", default="int8,onnx", help="comma-separated engines to compare")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=200, help="max images to load")
+    args = parser.parse_args()
+
+    # Weights only: the server engine (SHIELD_ENGINE) may quantize them in place
+    detector.load_model(with_engine=False)
+    images = load_images(args.image_dir, args.limit)
+    if not images:
+        sys.exit(f"No images found in {args.image_dir}")
+
+    pixel_values = detector.preprocess_images([detector.prepare_image(img) for img in images])
+    timing_batch = pixel_values[:args.batch_size]
+    image_size = detector.model.config.vision_config.image_size
+
+    reference = TorchEngine(detector.model, compile_model=False, channels_last=False)
+    ref_probs = ai_probs(reference, pixel_values, args.batch_size)
+    ref_time = time_engine(reference, timing_batch)
+
+    report = {
+        "images": len(images),
+        "batch_size": len(timing_batch),
+        "reference": {"engine": reference.name, "median_batch_ms": ref_time * 1000.0},
+        "engines": [],
+        "preprocess": compare_with_processor(
+            detector.fast_preprocessor, detector.processor, images, sharpness=detector.SHARPNESS_FACTOR
+        ),
+        "analysis": analysis_report(images),
+        "augmentation": augmentation_report(reference, images, args.batch_size)
+    }
+
+    for name in [n.strip() for n in args.engines.split(",") if n.strip()]:
+        # inplace=False keeps the fp32 reference weights intact
+        engine = create_engine(name, detector.model, detector.MODEL_ID, image_size, inplace=False)
+        if engine.name.split("+")[0] != name:
+            report["engines"].append({"engine": name, "error": "unavailable"})
+            continue
+
+        probs = ai_probs(engine, pixel_values, args.batch_size)
+        diff = (probs - ref_probs).abs()
+        flips = int(((probs > 0.5) != (ref_probs > 0.5)).sum())
+        elapsed = time_engine(engine, timing_batch)
+
+        report["engines"].append({
+            "engine": engine.name,
+            "max_abs_prob_diff": float(diff.max()),
+            "mean_abs_prob_diff": float(diff.mean()),
+            "label_flips": flips,
+            "median_batch_ms": elapsed * 1000.0,
+            "speedup": ref_time / elapsed if elapsed else None
+        })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+"""
+Offline bulk scanner for directories and URL lists
+
+Usage:
+    python tools/scan.py SOURCE [SOURCE ...] [--out results.jsonl] [--format jsonl|parquet]
+                         [--workers N] [--threads T] [--batch-size 32] [--fast]
+                         [--engine torch|int8|onnx|stub] [--restart] [--retry-errors]
+
+A SOURCE is a directory (walked recursively for images), an image file,
+an http(s) URL, a text file with one path or URL per line, or "-" for
+such a list on stdin.
+
+Decode worker processes download/read each image, scan its raw bytes for
+generator metadata, decode, enhance and preprocess it (and compute the
+bias-correction statistics), so the main process only runs the model:
+prepared images from many workers meet in the inference batcher and go
+through the model in shared forward passes. Up to --prefetch images
+are in flight (decoding or waiting for the model), by default two
+batches' worth, so forward passes fill up to --batch-size.
+
+Results stream to the output as they finish, one record per image with
+its id (path or URL). The output doubles as the checkpoint: rerunning the
+same command skips every id already written, so a crashed or interrupted
+run resumes where it stopped. Parquet output is written as numbered part
+files in a directory (needs pyarrow). Throughput and ETA go to stderr.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+# Make backend modules importable when run from anywhere
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+
+# Flat columns of the Parquet output and their pyarrow types; everything
+# else goes into "result" as JSON. Every part shares this schema, so a part
+# without errors doesn't get a null-typed "error" column.
+PARQUET_COLUMNS = {
+    "id": "string",
+    "prediction": "string",
+    "ai_probability": "float64",
+    "human_probability": "float64",
+    "confidence": "float64",
+    "method": "string",
+    "error": "string",
+}
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 1.0
+
+# ----------------------------------------------------
+# SOURCES
+# ----------------------------------------------------
+
+def is_url(ref: str) -> bool:
+    return ref.startswith(("http://", "https://"))
+
+def iter_refs(source: str):
+    """Image paths/URLs named by one SOURCE argument"""
+    if source == "-":
+        yield from (line.strip() for line in sys.stdin if line.strip())
+    elif is_url(source):
+        yield source
+    elif os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+    elif source.lower().endswith(IMAGE_EXTENSIONS):
+        yield source
+    else:
+        with open(source, encoding="utf-8") as f:
+            yield from (line.strip() for line in f if line.strip() and not line.startswith("#"))
+
+# ----------------------------------------------------
+# DECODE WORKERS (child processes)
+# ----------------------------------------------------
+
+def init_worker():
+    """One torch thread per worker: the workers are the parallelism"""
+    import torch
+    torch.set_num_threads(1)
+
+    from utils.logs import configure_logging
+    from utils import detector
+    configure_logging()
+    detector.load_preprocessor()
+
+def read_ref(ref: str):
+    """Raw bytes of a path or URL (None if missing, unreadable or too large)"""
+    from utils import detector
+
+    if is_url(ref):
+        return detector.download_bytes(ref)
+    try:
+        if os.path.getsize(ref) > detector.MAX_DOWNLOAD_BYTES:
+            return None
+        with open(ref, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def load_item(ref: str, check_metadata: bool):
+    """
+    Everything before the model for one image
+    Returns (ref, response dict) when metadata answers or loading failed,
+    otherwise (ref, PreparedImage)
+    """
+    from utils import detector
+    from utils.provenance import PROVENANCE_SCAN, scan_provenance
+
+    try:
+        content = read_ref(ref)
+        if content is None:
+            return ref, detector.error_response("Failed to read image")
+
+        if check_metadata and PROVENANCE_SCAN:
+            hit = scan_provenance(content)
+            if hit.source:
+                return ref, detector.metadata_response(hit.source, hit.field)
+
+        img = detector.decode_image_bytes(content)
+        if img is None:
+            return ref, detector.error_response("Invalid or unsafe image")
+
+        prepared = detector.prepare_detection(img, check_metadata=check_metadata)
+        if not isinstance(prepared, dict):
+            prepared.analyze()  # Here, in parallel, rather than in the model process
+        return ref, prepared
+
+    except Exception as e:
+        return ref, detector.error_response(str(e))
+
+# ----------------------------------------------------
+# OUTPUT + CHECKPOINT
+# ----------------------------------------------------
+
+class JsonlWriter:
+    """Appends one JSON record per line; the file is also the checkpoint"""
+
+    def __init__(self, path: str, restart: bool, flush_every: int):
+        self.path = path
+        self.flush_every = flush_every
+        self.pending = 0
+        if restart and os.path.exists(path):
+            os.remove(path)
+        self._drop_partial_line()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _drop_partial_line(self):
+        """A crash can leave half a record at the end: cut it off"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+
+    def done_ids(self, retry_errors: bool) -> set:
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if retry_errors and record.get("prediction") == "error":
+                    done.discard(record["id"])
+                else:
+                    done.add(record["id"])
+        return done
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record) + "\n")
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class ParquetWriter:
+    """Numbered part files in a directory; each part is written whole, so parts are never partial"""
+
+    def __init__(self, path: str, restart: bool, flush_every: int):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit("Parquet output needs pyarrow (pip install pyarrow), or use --format jsonl")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.schema = pyarrow.schema(
+            [(column, getattr(pyarrow, kind)()) for column, kind in PARQUET_COLUMNS.items()]
+            + [("result", pyarrow.string())]
+        )
+
+        self.path = path
+        self.flush_every = flush_every
+        self.rows = []
+        os.makedirs(path, exist_ok=True)
+        if restart:
+            for name in self._parts():
+                os.remove(os.path.join(path, name))
+        self.next_part = len(self._parts())
+
+    def _parts(self) -> list:
+        return sorted(name for name in os.listdir(self.path) if name.startswith("part-") and name.endswith(".parquet"))
+
+    def done_ids(self, retry_errors: bool) -> set:
+        done = set()
+        for name in self._parts():
+            table = self.pq.read_table(os.path.join(self.path, name), columns=["id", "prediction"])
+            for ref, prediction in zip(table.column("id").to_pylist(), table.column("prediction").to_pylist()):
+                if retry_errors and prediction == "error":
+                    done.discard(ref)
+                else:
+                    done.add(ref)
+        return done
+
+    def write(self, record: dict):
+        row = {column: record.get(column) for column in PARQUET_COLUMNS}
+        row["result"] = json.dumps(record)
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        part = os.path.join(self.path, f"part-{self.next_part:05d}.parquet")
+        self.pq.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema), part + ".tmp")
+        os.replace(part + ".tmp", part)
+        self.next_part += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+# ----------------------------------------------------
+# PROGRESS
+# ----------------------------------------------------
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class Progress:
+    def __init__(self, total: int, skipped: int):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.last = 0.0
+
+    def update(self, record: dict, force=False):
+        if record is not None:
+            self.done += 1
+            self.errors += record.get("prediction") == "error"
+
+        now = time.perf_counter()
+        if not force and now - self.last < PROGRESS_INTERVAL:
+            return
+        self.last = now
+
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        remaining = self.total - self.done
+        eta = format_duration(remaining / rate) if rate else "?"
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        sys.stderr.write(
+            f"\r[Shield] {self.done:,}/{self.total:,} ({percent:.1f}%)  {rate:.1f} img/s  "
+            f"ETA {eta}  errors {self.errors:,}  resumed past {self.skipped:,}   "
+        )
+        sys.stderr.flush()
+
+# ----------------------------------------------------
+# MAIN
+# ----------------------------------------------------
+
+def main():
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+")
+    parser.add_argument("--out", default="scan.jsonl", help="JSONL file, or directory of Parquet parts")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default=None, help="default: from --out")
+    parser.add_argument("--workers", type=int, default=max(1, cpus // 2), help="decode processes")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads for the model (0 = remaining cores)")
+    parser.add_argument("--batch-size", type=int, default=32, help="largest forward pass")
+    parser.add_argument("--prefetch", type=int, default=0, help="images in flight (0 = the larger of 4 per worker and 2 batches)")
+    parser.add_argument("--fast", action="store_true", help="single pass, no ensemble (like /detect/fast)")
+    parser.add_argument("--no-metadata", action="store_true", help="skip the metadata checks")
+    parser.add_argument("--engine", default=None, help="SHIELD_ENGINE (default: environment, else torch)")
+    parser.add_argument("--flush-every", type=int, default=500, help="records per checkpoint flush")
+    parser.add_argument("--restart", action="store_true", help="discard earlier output instead of resuming")
+    parser.add_argument("--retry-errors", action="store_true", help="on resume, retry images that failed")
+    args = parser.parse_args()
+    if args.prefetch and args.prefetch < args.batch_size:
+        parser.error(f"--prefetch {args.prefetch} can't fill a --batch-size {args.batch_size} forward pass")
+
+    # Before any backend import: engine, batch shape, quieter per-image warnings
+    if args.engine:
+        os.environ["SHIELD_ENGINE"] = args.engine
+    os.environ["SHIELD_BATCH_MAX_SIZE"] = str(args.batch_size)
+    os.environ.setdefault("SHIELD_BATCH_MAX_WAIT_MS", "20")
+    os.environ.setdefault("SHIELD_LOG_LEVEL", "ERROR")
+
+    import torch
+    from utils.logs import configure_logging, logger
+    from utils import detector
+    configure_logging()
+
+    out_format = args.format or ("parquet" if args.out.endswith((".parquet", "/")) or os.path.isdir(args.out) else "jsonl")
+    writer_class = ParquetWriter if out_format == "parquet" else JsonlWriter
+    writer = writer_class(args.out, args.restart, args.flush_every)
+
+    done = writer.done_ids(args.retry_errors)
+    todo, seen = [], set()
+    for source in args.sources:
+        for ref in iter_refs(source):
+            if ref not in done and ref not in seen:
+                seen.add(ref)
+                todo.append(ref)
+    skipped = len(done)
+    del seen, done
+
+    if not todo:
+        print(f"[Shield] Nothing to do ({skipped:,} already in {args.out})", file=sys.stderr)
+        writer.close()
+        return
+
+    torch.set_num_threads(args.threads or max(1, cpus - args.workers))
+    detector.load_model()
+    detector.warm_up([1, args.batch_size])
+
+    # Enough in flight that the batcher's forward passes fill
+    prefetch = args.prefetch or max(4 * args.workers, 2 * args.batch_size)
+    check_metadata = not args.no_metadata
+    use_ensemble = not args.fast
+    progress = Progress(len(todo), skipped)
+
+    def classify(ref, prepared):
+        try:
+            return ref, detector.classify_prepared(prepared, use_ensemble=use_ensemble)
+        except Exception as e:
+            return ref, detector.error_response(str(e))
+
+    def finish(ref, result):
+        record = {"id": ref}
+        record.update(result)
+        writer.write(record)
+        progress.update(record)
+
+    # spawn, not fork: the parent already runs torch thread pools
+    context = multiprocessing.get_context("spawn")
+    refs = iter(todo)
+    loading, inferring = set(), set()
+
+    decoders = ProcessPoolExecutor(args.workers, mp_context=context, initializer=init_worker)
+    inference = ThreadPoolExecutor(2 * args.batch_size, thread_name_prefix="shield-scan")
+
+    def refill():
+        while len(loading) + len(inferring) < prefetch:
+            ref = next(refs, None)
+            if ref is None:
+                return
+            loading.add(decoders.submit(load_item, ref, check_metadata))
+
+    try:
+        refill()
+        while loading or inferring:
+            finished, _ = wait(loading | inferring, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in loading:
+                    loading.discard(future)
+                    ref, prepared = future.result()
+                    if isinstance(prepared, dict):
+                        finish(ref, prepared)
+                    else:
+                        # Many of these in flight at once fill the batcher's forward passes
+                        inferring.add(inference.submit(classify, ref, prepared))
+                else:
+                    inferring.discard(future)
+                    finish(*future.result())
+            refill()
+            progress.update(None)
+
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; rerun the same command to resume")
+    finally:
+        decoders.shutdown(wait=False, cancel_futures=True)
+        inference.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+        progress.update(None, force=True)
+        sys.stderr.write("\n")
+
+    stats = detector.get_inference_stats()
+    print(json.dumps({
+        "scanned": progress.done,
+        "errors": progress.errors,
+        "resumed_past": skipped,
+        "seconds": round(time.perf_counter() - progress.started, 2),
+        "images_per_second": round(progress.done / max(1e-9, time.perf_counter() - progress.started), 2),
+        "avg_batch_size": round(stats["avg_batch_size"], 2),
+        "near_duplicates": detector.get_near_duplicate_stats()
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from utils import metrics
+
+# ----------------------------------------------------
+# ADMISSION CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# Set to 0 to hand work straight to the inference threads (no lanes, no shedding)
+ADMISSION_ENABLED = os.environ.get("SHIELD_ADMISSION", "1") == "1"
+
+# Default per-request deadlines by lane (clients may ask for less with X-Shield-Deadline-Ms)
+LANE_DEADLINE_MS = {
+    "interactive": float(os.environ.get("SHIELD_INTERACTIVE_DEADLINE_MS", "8000")),
+    "bulk": float(os.environ.get("SHIELD_BULK_DEADLINE_MS", "30000")),
+}
+
+# Requests allowed to wait per lane before new ones are turned away
+LANE_MAX_QUEUE = {
+    "interactive": int(os.environ.get("SHIELD_INTERACTIVE_MAX_QUEUE", "64")),
+    "bulk": int(os.environ.get("SHIELD_BULK_MAX_QUEUE", "16")),
+}
+
+# Inference slots bulk work may hold at once (0 = all but one, so hover scans always find a free slot)
+BULK_SLOTS = int(os.environ.get("SHIELD_BULK_SLOTS", "0"))
+
+# How often waiting/running requests check for a client disconnect
+DISCONNECT_POLL_SECONDS = 0.25
+
+DEADLINE_HEADER = "x-shield-deadline-ms"
+
+# Lanes in the order free slots are handed out
+LANES = ("interactive", "bulk")
+
+# ----------------------------------------------------
+# ERRORS
+# ----------------------------------------------------
+
+class Overloaded(Exception):
+    """The lane's queue is full; status/retry_after are what the client gets"""
+
+    def __init__(self, lane: str, status: int, retry_after: int):
+        super().__init__(f"Server busy ({lane} queue full)")
+        self.lane = lane
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Abandoned(Exception):
+    """Work nobody is waiting for any more; dropped wherever it is noticed"""
+
+
+class DeadlineExceeded(Abandoned):
+    def __init__(self):
+        super().__init__("Deadline exceeded")
+
+
+class ClientDisconnected(Abandoned):
+    def __init__(self):
+        super().__init__("Client disconnected")
+
+# ----------------------------------------------------
+# TICKETS
+# ----------------------------------------------------
+# A ticket follows one request from admission to the model. It travels in
+# a contextvar, which run_inference copies into the worker thread, so the
+# detector and batcher can drop work that is no longer wanted.
+
+class Ticket:
+    """Lane, deadline and cancellation state of one request"""
+
+    __slots__ = ("lane", "deadline", "shed", "cancelled", "_disconnected")
+
+    def __init__(self, lane: str, deadline_ms: float, disconnected=None, shed=True):
+        self.lane = lane
+        self.deadline = time.monotonic() + deadline_ms / 1000.0
+        self.shed = shed
+        self.cancelled = False
+        self._disconnected = disconnected
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def error(self) -> Optional[Abandoned]:
+        """The reason to drop this request's work, or None while it's still wanted"""
+        if self.cancelled:
+            return ClientDisconnected()
+        if self.remaining() <= 0:
+            return DeadlineExceeded()
+        return None
+
+    def check(self):
+        error = self.error()
+        if error is not None:
+            raise error
+
+    async def poll_disconnect(self) -> bool:
+        """Ask the server whether the client went away; marks the ticket cancelled"""
+        if not self.cancelled and self._disconnected is not None and await self._disconnected():
+            self.cancelled = True
+        return self.cancelled
+
+
+current_ticket = contextvars.ContextVar("shield_ticket", default=None)
+
+def request_ticket(lane: str, request=None, shed=True, watch=True) -> Ticket:
+    """
+    Ticket for an HTTP request: lane default deadline, shortened by the
+    deadline header; watch=False when something else already notices
+    the client leaving (streamed responses)
+    """
+    requested = request.headers.get(DEADLINE_HEADER) if request is not None else None
+    disconnected = request.is_disconnected if request is not None and watch else None
+    return lane_ticket(lane, requested, disconnected, shed=shed)
+
+def lane_ticket(lane: str, deadline_ms=None, disconnected=None, shed=True) -> Ticket:
+    """Ticket with the lane's default deadline, or the client's shorter one"""
+    deadline = LANE_DEADLINE_MS[lane]
+    if deadline_ms is not None:
+        try:
+            deadline = min(deadline, float(deadline_ms))
+        except (TypeError, ValueError):
+            pass
+    return Ticket(lane, deadline, disconnected, shed=shed)
+
+def item_ticket(batch: Ticket, position: int, slots: int) -> Ticket:
+    """
+    Ticket for one item of a batch admitted as a whole
+    The items take the lane's slots a round at a time, so each gets its own
+    deadline: the batch's budget once per round up to and including its own
+    """
+    rounds = position // max(1, slots) + 1
+    budget_ms = max(0.0, batch.remaining()) * 1000.0
+    return Ticket(batch.lane, budget_ms * rounds, shed=batch.shed)
+
+def check_ticket():
+    """Raise if the current request's work should be dropped (no-op outside a request)"""
+    ticket = current_ticket.get()
+    if ticket is not None:
+        ticket.check()
+
+async def watch(ticket: Ticket, future):
+    """
+    Await work running on another thread, polling for a client disconnect
+    A disconnect only marks the ticket; the worker drops the rest of the
+    work the next time it checks, and we still wait for the thread to let go
+    """
+    try:
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return future.result()
+            await ticket.poll_disconnect()
+    except asyncio.CancelledError:
+        # The worker raises Abandoned once it notices; nobody reads that
+        ticket.cancelled = True
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        raise
+
+# ----------------------------------------------------
+# ADMISSION CONTROLLER
+# ----------------------------------------------------
+
+SHED = metrics.counter(
+    "shield_shed_total", "Requests dropped before or during inference", labels=("lane", "reason")
+)
+
+
+class _Waiter:
+    __slots__ = ("ticket", "future")
+
+    def __init__(self, ticket: Ticket, future: asyncio.Future):
+        self.ticket = ticket
+        self.future = future
+
+
+class AdmissionController:
+    """
+    Priority lanes in front of the inference threads
+
+    At most `slots` requests run at once. A freed slot goes to the waiting
+    interactive request with the earliest deadline, then to bulk work
+    (which may hold at most bulk_slots). A full lane queue answers at once
+    with Overloaded; waiters whose deadline passes or whose client leaves
+    give up their place. Lives on the event loop: not thread-safe.
+    """
+
+    def __init__(self, slots: int, bulk_slots: int = 0, max_queue=None):
+        self.slots = max(1, slots)
+        self.bulk_slots = bulk_slots or max(1, self.slots - 1)
+        self.max_queue = dict(max_queue or LANE_MAX_QUEUE)
+
+        self._running = {lane: 0 for lane in LANES}
+        self._waiting = {lane: [] for lane in LANES}
+        self._queued = {lane: 0 for lane in LANES}
+        self._seq = itertools.count()
+
+        # Stats
+        self._admitted = {lane: 0 for lane in LANES}
+        self._shed = {lane: {"rejected": 0, "deadline": 0, "disconnected": 0} for lane in LANES}
+        self._service_seconds = 0.0  # EWMA of slot hold time, for Retry-After
+
+    # ------------------------------------------------
+    # Public API
+    # ------------------------------------------------
+
+    def check(self, lane: str):
+        """Raise Overloaded if a new request on this lane would be turned away"""
+        if self._queued[lane] >= self.max_queue[lane]:
+            self._record_shed(lane, "rejected")
+            raise Overloaded(lane, 429 if lane == "bulk" else 503, self.retry_after(lane))
+
+    @asynccontextmanager
+    async def slot(self, ticket: Ticket):
+        """Hold an inference slot for the block; raises Overloaded or Abandoned instead"""
+        with metrics.stage("admission"):
+            await self._acquire(ticket)
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - acquired
+            self._service_seconds = held if not self._service_seconds else 0.8 * self._service_seconds + 0.2 * held
+            self._release(ticket.lane)
+
+    def retry_after(self, lane: str) -> int:
+        """Seconds until the lane's current backlog should have drained"""
+        slots = self.slots if lane == "interactive" else self.bulk_slots
+        backlog = sum(self._queued.values()) if lane == "bulk" else self._queued[lane]
+        return max(1, min(30, math.ceil((backlog + 1) * (self._service_seconds or 1.0) / slots)))
+
+    def record_abandoned(self, ticket: Ticket, error: Abandoned):
+        self._record_shed(ticket.lane, "disconnected" if isinstance(error, ClientDisconnected) else "deadline")
+
+    def stats(self) -> dict:
+        return {
+            "slots": self.slots,
+            "bulk_slots": self.bulk_slots,
+            "avg_service_ms": self._service_seconds * 1000.0,
+            "lanes": {
+                lane: {
+                    "running": self._running[lane],
+                    "queued": self._queued[lane],
+                    "max_queue": self.max_queue[lane],
+                    "deadline_ms": LANE_DEADLINE_MS[lane],
+                    "admitted": self._admitted[lane],
+                    "shed": dict(self._shed[lane])
+                }
+                for lane in LANES
+            }
+        }
+
+    # ------------------------------------------------
+    # Slots
+    # ------------------------------------------------
+
+    def _can_run(self, lane: str) -> bool:
+        if sum(self._running.values()) >= self.slots:
+            return False
+        return lane == "interactive" or self._running[lane] < self.bulk_slots
+
+    def _grant(self, lane: str):
+        self._running[lane] += 1
+        self._admitted[lane] += 1
+
+    async def _acquire(self, ticket: Ticket):
+        lane = ticket.lane
+        ticket.check()
+
+        if self._can_run(lane) and not any(self._waiting[ahead] for ahead in LANES[:LANES.index(lane) + 1]):
+            self._grant(lane)
+            return
+
+        if ticket.shed:
+            self.check(lane)
+
+        waiter = _Waiter(ticket, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiting[lane], (ticket.deadline, next(self._seq), waiter))
+        self._queued[lane] += 1
+
+        try:
+            while True:
+                timeout = min(DISCONNECT_POLL_SECONDS, max(0.0, ticket.remaining()))
+                await asyncio.wait({waiter.future}, timeout=timeout)
+                if waiter.future.done():
+                    return  # _dispatch already counted us as running
+
+                error = ticket.error()
+                if error is None and await ticket.poll_disconnect():
+                    error = ticket.error()
+                if error is not None:
+                    self.record_abandoned(ticket, error)
+                    raise error
+
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(lane)  # Granted just as we gave up: pass it on
+            else:
+                waiter.future.cancel()
+                self._queued[lane] -= 1
+            raise
+
+    def _release(self, lane: str):
+        self._running[lane] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiters: interactive first, earliest deadline first"""
+        for lane in LANES:
+            heap = self._waiting[lane]
+            while heap and self._can_run(lane):
+                _, _, waiter = heapq.heappop(heap)
+                if waiter.future.done():
+                    continue  # Gave up while queued
+                self._queued[lane] -= 1
+                self._grant(lane)
+                waiter.future.set_result(True)
+
+    def _record_shed(self, lane: str, reason: str):
+        self._shed[lane][reason] += 1
+        SHED.inc(lane=lane, reason=reason)
@@ -0,0 +1,190 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from utils.logs import logger
+
+# ----------------------------------------------------
+# DYNAMIC MICRO-BATCHING
+# ----------------------------------------------------
+
+class _BatchRequest:
+    """One caller's items plus the future its results are delivered through"""
+
+    __slots__ = ("items", "future", "enqueued_at", "ticket")
+
+    def __init__(self, items: list, ticket=None):
+        self.items = items
+        self.ticket = ticket
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Collect items from concurrent callers into shared batches
+
+    Callers block in submit() while a single worker thread waits up to
+    max_wait_ms (or until max_batch_size items are queued), runs run_batch
+    once over everything it gathered and hands each caller its own slice
+    of the results. A caller's items are never split across batches.
+    Requests whose ticket (utils/admission.py) reports an error by the
+    time their batch is formed are failed with it instead of being run.
+    """
+
+    def __init__(self, run_batch, max_batch_size=16, max_wait_ms=10.0, name="inference"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._carry = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # Stats
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._requests = 0
+        self._errors = 0
+        self._dropped = 0
+        self._max_seen = 0
+        self._size_counts = {}
+        self._total_wait = 0.0
+
+    def submit(self, items: list, ticket=None) -> list:
+        """Queue items for the next batch and block until their results are ready"""
+        if not items:
+            return []
+
+        self._ensure_started()
+        request = _BatchRequest(list(items), ticket)
+        self._queue.put(request)
+        return request.future.result()
+
+    def configure(self, max_batch_size=None, max_wait_ms=None):
+        """Change the batch limits at runtime (used from the next batch on)"""
+        if max_batch_size is not None:
+            self.max_batch_size = max(1, int(max_batch_size))
+        if max_wait_ms is not None:
+            self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+    def stats(self) -> dict:
+        """Queue depth and batch-size statistics"""
+        with self._stats_lock:
+            batches = self._batches
+            return {
+                "name": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize() + (1 if self._carry is not None else 0),
+                "batches": batches,
+                "requests": self._requests,
+                "items": self._items,
+                "errors": self._errors,
+                "dropped": self._dropped,
+                "avg_batch_size": (self._items / batches) if batches else 0.0,
+                "max_batch_size_seen": self._max_seen,
+                "batch_size_counts": dict(sorted(self._size_counts.items())),
+                "avg_queue_wait_ms": (self._total_wait / self._requests * 1000.0) if self._requests else 0.0
+            }
+
+    # ------------------------------------------------
+    # Worker
+    # ------------------------------------------------
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._worker, name=f"shield-{self.name}-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _next_request(self, timeout=None):
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        if timeout is None:
+            return self._queue.get()
+        return self._queue.get(timeout=timeout)
+
+    def _collect(self) -> list:
+        """Block for the first request, then gather more until the batch is full or the wait expires"""
+        batch = [self._next_request()]
+        size = len(batch[0].items)
+        deadline = time.perf_counter() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._next_request(timeout=remaining)
+            except queue.Empty:
+                break
+
+            if size + len(request.items) > self.max_batch_size:
+                # Keep it whole for the next batch
+                self._carry = request
+                break
+
+            batch.append(request)
+            size += len(request.items)
+
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._drop_abandoned(self._collect())
+            if not batch:
+                continue
+            items = [item for request in batch for item in request.items]
+            started = time.perf_counter()
+
+            try:
+                results = self.run_batch(items)
+            except Exception as e:
+                logger.error("Batch error (%s items): %s", len(items), e)
+                with self._stats_lock:
+                    self._errors += 1
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            self._record(batch, len(items), started)
+
+            offset = 0
+            for request in batch:
+                count = len(request.items)
+                request.future.set_result(results[offset:offset + count])
+                offset += count
+
+    def _drop_abandoned(self, batch: list) -> list:
+        """Fail requests nobody is waiting for any more (deadline passed, client gone)"""
+        kept = []
+        for request in batch:
+            error = request.ticket.error() if request.ticket is not None else None
+            if error is None:
+                kept.append(request)
+            else:
+                request.future.set_exception(error)
+        if len(kept) < len(batch):
+            with self._stats_lock:
+                self._dropped += len(batch) - len(kept)
+        return kept
+
+    def _record(self, batch, size, started):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._requests += len(batch)
+            self._max_seen = max(self._max_seen, size)
+            self._size_counts[size] = self._size_counts.get(size, 0) + 1
+            self._total_wait += sum(started - request.enqueued_at for request in batch)
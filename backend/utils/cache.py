@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+# ----------------------------------------------------
+# CACHE CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# Entries kept per level (URL and content) before LRU eviction
+CACHE_MAX_ENTRIES = int(os.environ.get("SHIELD_CACHE_MAX_ENTRIES", "10000"))
+
+# Seconds a URL result is served without asking the image host again
+CACHE_URL_TTL = float(os.environ.get("SHIELD_CACHE_URL_TTL", "3600"))
+
+# "exact" hashes decoded pixels; "perceptual" also matches recompressed/resized copies
+CACHE_HASH_METHOD = os.environ.get("SHIELD_CACHE_HASH", "exact")
+
+# Optional SQLite file so results survive restarts (empty = memory only)
+CACHE_DB_PATH = os.environ.get("SHIELD_CACHE_DB", "")
+
+# Set to 0 to always run detection (e.g. when benchmarking the pipeline)
+CACHE_ENABLED = os.environ.get("SHIELD_CACHE_ENABLED", "1") == "1"
+
+# ----------------------------------------------------
+# IMAGE HASHING
+# ----------------------------------------------------
+
+def image_digest(img: Image.Image, method: str = None) -> str:
+    """
+    Hash of the decoded image
+    exact: every pixel plus the size, so any re-encode with identical pixels matches
+    perceptual: 64-bit difference hash, tolerant to recompression and resizing
+    """
+    method = method or CACHE_HASH_METHOD
+
+    if method == "perceptual":
+        gray = img.convert("L").resize((9, 8), Image.BILINEAR)
+        pixels = list(gray.getdata())
+        bits = 0
+        for row in range(8):
+            for col in range(8):
+                left = pixels[row * 9 + col]
+                right = pixels[row * 9 + col + 1]
+                bits = (bits << 1) | (1 if left > right else 0)
+        return f"p:{bits:016x}"
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{img.mode}:{img.width}x{img.height}".encode())
+    h.update(img.tobytes())
+    return "x:" + h.hexdigest()
+
+# ----------------------------------------------------
+# LRU STORE WITH OPTIONAL SQLITE BACKING
+# ----------------------------------------------------
+
+class _LRUStore:
+    """
+    Bounded in-memory LRU, optionally mirrored to a SQLite table
+    Mirror writes go to the writer executor on their own connection, so
+    put() never waits for SQLite (callers include the event loop).
+    """
+
+    _PRUNE_EVERY = 100
+
+    def __init__(self, level: str, max_entries: int, db=None, writer=None, writer_db=None):
+        self.level = level
+        self.max_entries = max(1, max_entries)
+        self.db = db
+        self.writer = writer
+        self.writer_db = writer_db
+        self._entries = OrderedDict()
+        self._puts = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+
+        if self.db is not None:
+            row = self.db.execute(
+                "SELECT value FROM entries WHERE level = ? AND key = ?", (self.level, key)
+            ).fetchone()
+            if row is not None:
+                entry = json.loads(row[0])
+                self._remember(key, entry)
+                return entry
+
+        return None
+
+    def put(self, key: str, entry: dict):
+        self._remember(key, entry)
+
+        if self.writer is not None:
+            self._puts += 1
+            prune = self._puts % self._PRUNE_EVERY == 0
+            self.writer.submit(self._write, key, entry, time.time(), prune)
+
+    def _write(self, key: str, entry: dict, updated_at: float, prune: bool):
+        self.writer_db.execute(
+            "INSERT OR REPLACE INTO entries (level, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (self.level, key, json.dumps(entry), updated_at)
+        )
+        if prune:
+            self._prune_db()
+        self.writer_db.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _prune_db(self):
+        count = self.writer_db.execute(
+            "SELECT COUNT(*) FROM entries WHERE level = ?", (self.level,)
+        ).fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.writer_db.execute(
+                "DELETE FROM entries WHERE level = ? AND key IN "
+                "(SELECT key FROM entries WHERE level = ? ORDER BY updated_at ASC LIMIT ?)",
+                (self.level, self.level, excess)
+            )
+
+# ----------------------------------------------------
+# TWO-LEVEL RESULT CACHE
+# ----------------------------------------------------
+
+class ResultCache:
+    """
+    Detection results keyed by URL and by image content
+
+    URL level: result per (mode, url) with a TTL; stale entries keep the
+    host's ETag/Last-Modified so they can be revalidated with a
+    conditional request instead of a full download.
+    Content level: result per (mode, image hash), shared by every URL and
+    upload that carries the same image.
+    """
+
+    def __init__(self, namespace="", max_entries=CACHE_MAX_ENTRIES, url_ttl=CACHE_URL_TTL, db_path=CACHE_DB_PATH,
+                 enabled=CACHE_ENABLED):
+        self.namespace = namespace
+        self.enabled = enabled
+        self.url_ttl = url_ttl
+        self._lock = threading.Lock()
+
+        self._db = None
+        self._writer = None
+        writer_db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "level TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (level, key))"
+            )
+            self._db.commit()
+
+            # One writer thread with its own connection: WAL lets lookups
+            # read while it commits
+            writer_db = sqlite3.connect(db_path, check_same_thread=False)
+            writer_db.execute("PRAGMA synchronous=NORMAL")
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shield-cache-writer")
+
+        self._urls = _LRUStore("url", max_entries, self._db, self._writer, writer_db)
+        self._contents = _LRUStore("content", max_entries, self._db, self._writer, writer_db)
+
+        self._counters = {
+            "url_hits": 0,
+            "url_revalidated": 0,
+            "url_misses": 0,
+            "content_hits": 0,
+            "content_misses": 0
+        }
+
+    def _key(self, mode: str, key: str) -> str:
+        # Namespaced by model/version so persisted verdicts never outlive the model
+        return f"{self.namespace}|{mode}|{key}"
+
+    # ------------------------------------------------
+    # URL level
+    # ------------------------------------------------
+
+    def lookup_url(self, mode: str, url: str):
+        """
+        Returns (result, None) for a fresh hit, (None, entry) for a stale
+        entry with validators worth revalidating, (None, None) otherwise
+        """
+        if not self.enabled:
+            return None, None
+
+        with self._lock:
+            entry = self._urls.get(self._key(mode, url))
+
+            if entry is not None and entry["expires_at"] > time.time():
+                self._counters["url_hits"] += 1
+                return dict(entry["result"]), None
+
+            self._counters["url_misses"] += 1
+            if entry is not None and (entry.get("etag") or entry.get("last_modified")):
+                return None, entry
+            return None, None
+
+    def put_url(self, mode: str, url: str, result: dict, etag=None, last_modified=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            # A copy: the caller goes on to add timings/cache keys to its own
+            self._urls.put(self._key(mode, url), {
+                "result": dict(result),
+                "expires_at": time.time() + self.url_ttl,
+                "etag": etag,
+                "last_modified": last_modified
+            })
+
+    def revalidated(self, mode: str, url: str, entry: dict) -> dict:
+        """The host answered 304: extend the entry's TTL and return its result"""
+        with self._lock:
+            self._counters["url_revalidated"] += 1
+            entry = dict(entry, expires_at=time.time() + self.url_ttl)
+            self._urls.put(self._key(mode, url), entry)
+            return dict(entry["result"])
+
+    # ------------------------------------------------
+    # Content level
+    # ------------------------------------------------
+
+    def get_content(self, mode: str, digest: str):
+        if not self.enabled:
+            return None
+        with self._lock:
+            result = self._contents.get(self._key(mode, digest))
+            if result is not None:
+                self._counters["content_hits"] += 1
+                return dict(result)
+
+            self._counters["content_misses"] += 1
+            return None
+
+    def put_content(self, mode: str, digest: str, result: dict):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._contents.put(self._key(mode, digest), dict(result))
+
+    # ------------------------------------------------
+    # Stats
+    # ------------------------------------------------
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                self._counters,
+                url_entries=len(self._urls),
+                content_entries=len(self._contents),
+                max_entries=self._urls.max_entries,
+                url_ttl=self.url_ttl,
+                hash_method=CACHE_HASH_METHOD,
+                enabled=self.enabled,
+                persistent=self._db is not None
+            )
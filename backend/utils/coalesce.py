@@ -0,0 +1,108 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+
+# ----------------------------------------------------
+# COALESCING CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# Share in-flight downloads/inference between identical concurrent requests
+COALESCE_ENABLED = os.environ.get("SHIELD_COALESCE", "1") == "1"
+
+# ----------------------------------------------------
+# SINGLE-FLIGHT
+# ----------------------------------------------------
+# The first caller for a key (the leader) does the work; callers that
+# arrive while it is still running wait for the same result instead of
+# repeating it. Followers get their own shallow copy of the result dict.
+# If the leader's work fails with one of rerun_on (e.g. its client left),
+# followers don't inherit that: they run the work again themselves.
+
+def _copy(result):
+    return dict(result) if isinstance(result, dict) else result
+
+
+class _FlightStats:
+    def __init__(self, name: str, rerun_on=()):
+        self.name = name
+        self.rerun_on = tuple(rerun_on)
+        self.leaders = 0
+        self.coalesced = 0
+        self._inflight = {}
+
+    def stats(self) -> dict:
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": (self.coalesced / total) if total else 0.0
+        }
+
+
+class AsyncSingleFlight(_FlightStats):
+    """Single-flight for coroutines on the event loop (e.g. URL downloads)"""
+
+    async def run(self, key, fn, *args, **kwargs):
+        """
+        Await fn(*args, **kwargs), or the identical call already in flight
+        Returns (result, coalesced). The shared task is shielded: a caller
+        that goes away doesn't cancel the work for the others.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            try:
+                return _copy(await asyncio.shield(task)), True
+            except self.rerun_on:
+                return await self.run(key, fn, *args, **kwargs)
+
+        task = asyncio.ensure_future(fn(*args, **kwargs))
+        self._inflight[key] = task
+        self.leaders += 1
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task), False
+
+    def _finished(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved, so an orphaned failure isn't logged as unhandled
+
+
+class ThreadSingleFlight(_FlightStats):
+    """Single-flight for blocking calls made from worker threads (e.g. inference)"""
+
+    def __init__(self, name: str, rerun_on=()):
+        super().__init__(name, rerun_on)
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs), or wait for the identical call in flight; returns (result, coalesced)"""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                return _copy(future.result()), True
+            except self.rerun_on:
+                return self.run(key, fn, *args, **kwargs)
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
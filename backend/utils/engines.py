@@ -0,0 +1,226 @@
+import os
+import time
+
+import torch
+
+from utils.logs import logger
+
+# ----------------------------------------------------
+# ENGINE CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# "torch" (fp32), "int8" (dynamic quantized), "onnx" (onnxruntime),
+# or "stub" (no weights; for benchmarks and offline runs)
+ENGINE = os.environ.get("SHIELD_ENGINE", "torch")
+
+# Extra switches for the torch engine
+TORCH_COMPILE = os.environ.get("SHIELD_TORCH_COMPILE", "0") == "1"
+CHANNELS_LAST = os.environ.get("SHIELD_CHANNELS_LAST", "0") == "1"
+
+# Simulated forward-pass cost per image for the stub engine
+STUB_DELAY_MS = float(os.environ.get("SHIELD_STUB_DELAY_MS", "0"))
+
+# Size of the stub engine's embeddings (3 channels x 4x4 thumbnail)
+STUB_EMBEDDING_DIM = 48
+
+# Where the ONNX export is written and re-used from
+ONNX_CACHE_DIR = os.environ.get(
+    "SHIELD_ONNX_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "shield", "onnx")
+)
+
+# ----------------------------------------------------
+# PREDICTOR ENGINES
+# ----------------------------------------------------
+# Every engine takes the processor's pixel_values tensor (N, 3, H, W)
+# and returns float32 logits (N, num_labels) as a torch tensor.
+# logits_and_embeddings() also returns the pooled vision embedding
+# (N, hidden_size) the classifier head was applied to, from the same pass.
+
+class _LogitsAndEmbeddings(torch.nn.Module):
+    """SiglipForImageClassification's forward, also returning the mean-pooled patch embedding"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        hidden = self.model.vision_model(pixel_values=pixel_values).last_hidden_state
+        pooled = hidden.mean(dim=1)
+        return self.model.classifier(pooled), pooled
+
+
+class TorchEngine:
+    """Plain PyTorch inference, optionally channels-last and/or torch.compile'd"""
+
+    name = "torch"
+
+    def __init__(self, model, compile_model=TORCH_COMPILE, channels_last=CHANNELS_LAST):
+        self.model = model
+        self.channels_last = channels_last
+
+        if channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+            self.name += "+channels_last"
+
+        self._forward = _LogitsAndEmbeddings(self.model)
+        if compile_model:
+            self._forward = torch.compile(self._forward)
+            self.name += "+compile"
+
+    def logits(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.logits_and_embeddings(pixel_values)[0]
+
+    def logits_and_embeddings(self, pixel_values: torch.Tensor) -> tuple:
+        if self.channels_last:
+            pixel_values = pixel_values.contiguous(memory_format=torch.channels_last)
+
+        with torch.inference_mode():
+            logits, embeddings = self._forward(pixel_values)
+            return logits.float(), embeddings.float()
+
+
+class Int8Engine(TorchEngine):
+    """Dynamic int8 quantization of every Linear layer (weights int8, activations quantized on the fly)"""
+
+    name = "int8"
+
+    def __init__(self, model, inplace=True):
+        quantized = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=inplace
+        )
+        super().__init__(quantized, compile_model=False, channels_last=False)
+        self.name = "int8"
+
+
+class OnnxEngine:
+    """onnxruntime CPU session over an ONNX export of the classifier"""
+
+    name = "onnx"
+
+    def __init__(self, model, model_id: str, image_size: int, threads: int = 0):
+        import onnxruntime as ort
+
+        path = self.export(model, model_id, image_size)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @staticmethod
+    def export(model, model_id: str, image_size: int) -> str:
+        """Export once per model; later starts load the cached file"""
+        os.makedirs(ONNX_CACHE_DIR, exist_ok=True)
+        path = os.path.join(ONNX_CACHE_DIR, model_id.replace("/", "__") + f"-{image_size}-emb.onnx")
+        if os.path.exists(path):
+            return path
+
+        logger.info("Exporting model to ONNX: %s", path)
+        dummy = torch.zeros(1, 3, image_size, image_size)
+        export_args = dict(
+            input_names=["pixel_values"],
+            output_names=["logits", "embeddings"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}, "embeddings": {0: "batch"}},
+            opset_version=17
+        )
+
+        tmp_path = path + ".tmp"
+        with torch.no_grad():
+            try:
+                torch.onnx.export(_LogitsAndEmbeddings(model).eval(), (dummy,), tmp_path, dynamo=False, **export_args)
+            except TypeError:
+                # Older torch without the dynamo switch
+                torch.onnx.export(_LogitsAndEmbeddings(model).eval(), (dummy,), tmp_path, **export_args)
+        os.replace(tmp_path, path)
+        return path
+
+    def logits(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.logits_and_embeddings(pixel_values)[0]
+
+    def logits_and_embeddings(self, pixel_values: torch.Tensor) -> tuple:
+        feed = {self.input_name: pixel_values.detach().cpu().numpy()}
+        logits, embeddings = self.session.run(None, feed)
+        return torch.from_numpy(logits).float(), torch.from_numpy(embeddings).float()
+
+
+class StubEngine:
+    """
+    Deterministic stand-in for the classifier: no weights, no download
+    Logits follow the mean pixel value, so different images get different
+    (but repeatable) verdicts; the embedding is a 4x4 per-channel thumbnail
+    (STUB_EMBEDDING_DIM values); delay_ms adds a fixed per-image cost.
+    """
+
+    name = "stub"
+
+    def __init__(self, delay_ms: float = STUB_DELAY_MS):
+        self.delay = max(0.0, delay_ms) / 1000.0
+
+    def logits(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.logits_and_embeddings(pixel_values)[0]
+
+    def logits_and_embeddings(self, pixel_values: torch.Tensor) -> tuple:
+        if self.delay:
+            time.sleep(self.delay * len(pixel_values))
+        pixel_values = pixel_values.float()
+        score = pixel_values.mean(dim=(1, 2, 3)) * 4.0
+        embeddings = torch.nn.functional.adaptive_avg_pool2d(pixel_values, 4).flatten(1)
+        return torch.stack([score, -score], dim=1), embeddings
+
+
+def stub_model(image_size: int = 224):
+    """
+    (processor, model) pair for the stub engine
+    The processor is the default SigLIP one (built locally, nothing fetched);
+    the model only carries the config fields the detector reads.
+    """
+    from types import SimpleNamespace
+    from transformers import SiglipImageProcessor
+
+    processor = SiglipImageProcessor(size={"height": image_size, "width": image_size})
+    config = SimpleNamespace(
+        label2id={"ai": 0, "hum": 1},
+        id2label={0: "ai", 1: "hum"},
+        vision_config=SimpleNamespace(image_size=image_size, hidden_size=STUB_EMBEDDING_DIM)
+    )
+    return processor, SimpleNamespace(config=config)
+
+
+def create_engine(name: str, model, model_id: str, image_size: int, inplace=True):
+    """
+    Build the predictor engine selected by name
+    Falls back to fp32 torch if the engine's runtime isn't installed
+    """
+    try:
+        if name == "stub":
+            return StubEngine()
+        if name == "int8":
+            return Int8Engine(model, inplace=inplace)
+        if name == "onnx":
+            return OnnxEngine(model, model_id, image_size, threads=torch.get_num_threads())
+        if name != "torch":
+            logger.warning("Unknown engine '%s', using torch", name)
+
+    except ImportError as e:
+        logger.warning("Engine '%s' unavailable (%s), using torch", name, e)
+
+    return TorchEngine(model)
+
+# ----------------------------------------------------
+# LATENCY HELPER
+# ----------------------------------------------------
+
+def time_engine(engine, pixel_values: torch.Tensor, repeats=5) -> float:
+    """Median seconds per forward pass over repeats (after one warm-up run)"""
+    engine.logits(pixel_values)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        engine.logits(pixel_values)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2]
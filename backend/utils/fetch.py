@@ -0,0 +1,165 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from utils.detector import DOWNLOAD_HEADERS, DOWNLOAD_TIMEOUT, DownloadGuard
+from utils.logs import logger
+from utils.metrics import stage
+from utils.provenance import PREFIX_SCAN_BYTES, PROVENANCE_SCAN, ProvenanceResult, scan_provenance
+
+# ----------------------------------------------------
+# CONNECTION POOL CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# Total open connections across all image hosts
+HTTP_MAX_CONNECTIONS = int(os.environ.get("SHIELD_HTTP_MAX_CONNECTIONS", "100"))
+
+# Idle keep-alive connections kept around for reuse
+HTTP_MAX_KEEPALIVE = int(os.environ.get("SHIELD_HTTP_MAX_KEEPALIVE", "20"))
+
+# Concurrent downloads allowed against a single host
+HTTP_MAX_PER_HOST = int(os.environ.get("SHIELD_HTTP_MAX_PER_HOST", "8"))
+
+# ----------------------------------------------------
+# PER-HOST LIMITS
+# ----------------------------------------------------
+
+class _HostLimiter:
+    """Cap concurrent requests per host; entries are dropped once a host goes idle"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._hosts = {}
+
+    @asynccontextmanager
+    async def slot(self, host: str):
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = [asyncio.Semaphore(self.limit), 0]
+        entry[1] += 1
+
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._hosts.pop(host, None)
+
+
+_client = None
+_host_limiter = _HostLimiter(HTTP_MAX_PER_HOST)
+
+# ----------------------------------------------------
+# CLIENT LIFECYCLE
+# ----------------------------------------------------
+
+async def start_http_client():
+    """Create the shared pooled client (call on app startup)"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            headers=DOWNLOAD_HEADERS,
+            timeout=DOWNLOAD_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE
+            )
+        )
+    return _client
+
+async def close_http_client():
+    """Close the shared client (call on app shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+# ----------------------------------------------------
+# ASYNC DOWNLOAD
+# ----------------------------------------------------
+
+class FetchResult(NamedTuple):
+    """Outcome of a (possibly conditional) image download"""
+    content: Optional[bytes]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    not_modified: bool = False
+    provenance: Optional[ProvenanceResult] = None
+
+
+async def fetch_image(url: str, etag: str = None, last_modified: str = None) -> FetchResult:
+    """
+    Download an image without blocking the event loop
+    Pass the validators of a cached copy to revalidate it; a 304 comes
+    back as not_modified=True with no content. content is None on failure
+    or when the response is rejected as not an image / too large.
+    The metadata at the start of the file is scanned as it arrives; when it
+    names an AI generator the download stops there and the match comes
+    back as provenance= (content None).
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    try:
+        client = await start_http_client()
+        host = urlsplit(url).netloc.lower()
+
+        async with _host_limiter.slot(host):
+            with stage("download"):
+                async with client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304 and headers:
+                        return FetchResult(None, etag, last_modified, not_modified=True)
+
+                    response.raise_for_status()
+
+                    # Reject on headers, then stop mid-stream past the byte cap
+                    # or as soon as the image header shows oversized dimensions
+                    guard = DownloadGuard()
+                    reason = guard.check_headers(response.headers)
+                    scanned = not PROVENANCE_SCAN
+                    # Rescan the prefix only once it has doubled (linear, not per chunk)
+                    next_scan = 0
+                    validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+                    if reason is None:
+                        async for chunk in response.aiter_bytes():
+                            reason = guard.feed(chunk)
+                            if reason:
+                                break
+
+                            if not scanned and len(guard.buffer) >= next_scan:
+                                hit = scan_provenance(guard.buffer)
+                                if hit.source:
+                                    # Closing the stream drops the rest of the body
+                                    return FetchResult(None, *validators, provenance=hit)
+                                scanned = hit.complete or len(guard.buffer) >= PREFIX_SCAN_BYTES
+                                next_scan = min(2 * len(guard.buffer), PREFIX_SCAN_BYTES)
+
+                    if reason:
+                        logger.warning("Rejecting download: %s", reason)
+                        return FetchResult(None)
+
+                    if not scanned:
+                        # Metadata that sits after the pixels (WebP) or a short body
+                        hit = scan_provenance(guard.buffer)
+                        if hit.source:
+                            return FetchResult(None, *validators, provenance=hit)
+
+                    return FetchResult(guard.content(), *validators)
+
+    except Exception as e:
+        logger.warning("Download error: %s", e)
+        return FetchResult(None)
+
+async def fetch_image_bytes(url: str) -> bytes:
+    """Download raw image bytes without blocking the event loop"""
+    return (await fetch_image(url)).content
@@ -0,0 +1,25 @@
+import logging
+import os
+import sys
+
+# ----------------------------------------------------
+# LOGGING CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# DEBUG logs every request and prediction; INFO keeps startup and warnings
+LOG_LEVEL = os.environ.get("SHIELD_LOG_LEVEL", "INFO").upper()
+
+logger = logging.getLogger("shield")
+
+def configure_logging(level: str = None):
+    """Send the shield logger to stderr with the [Shield] prefix (idempotent)"""
+    logger.setLevel(level or LOG_LEVEL)
+
+    if not any(getattr(handler, "_shield", False) for handler in logger.handlers):
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("[Shield] %(message)s"))
+        handler._shield = True
+        logger.addHandler(handler)
+        logger.propagate = False
+
+    return logger
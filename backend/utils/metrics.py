@@ -0,0 +1,320 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs
+
+# ----------------------------------------------------
+# METRICS CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# Latency histogram buckets in seconds
+LATENCY_BUCKETS = tuple(
+    float(bound) for bound in os.environ.get(
+        "SHIELD_METRICS_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+    ).split(",") if bound.strip()
+)
+
+# Clients opt into a per-request "timings" block with ?timings=1 or this header
+TIMINGS_HEADER = b"x-shield-timings"
+
+# ----------------------------------------------------
+# METRIC TYPES
+# ----------------------------------------------------
+# Minimal Prometheus client: labelled counters, gauges and histograms that
+# render in the text exposition format. One lock per metric keeps
+# updates cheap enough for the hot path.
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in flight while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+_INF_LABEL = 'le="+Inf"'
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((key, (list(e[0]), e[1], e[2])) for key, e in self._values.items())
+
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, _INF_LABEL)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Callback(_Metric):
+    """
+    Values read at scrape time from a function returning a number or a
+    {label value (or tuple of values): number} dict; for state that's
+    already tracked elsewhere (batcher, cache)
+    """
+
+    def __init__(self, name: str, help_text: str, fn, labels=(), kind="gauge"):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> list:
+        try:
+            values = self.fn()
+        except Exception:
+            return []
+
+        if not isinstance(values, dict):
+            values = {(): values}
+
+        lines = self.header()
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+# ----------------------------------------------------
+# REGISTRY
+# ----------------------------------------------------
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+def counter(name, help_text, labels=()) -> Counter:
+    return _register(Counter(name, help_text, labels))
+
+def gauge(name, help_text, labels=()) -> Gauge:
+    return _register(Gauge(name, help_text, labels))
+
+def histogram(name, help_text, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help_text, labels, buckets))
+
+def callback(name, help_text, fn, labels=(), kind="gauge") -> Callback:
+    return _register(Callback(name, help_text, fn, labels, kind))
+
+def render_metrics() -> str:
+    """Every registered metric in the Prometheus text format"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# ----------------------------------------------------
+# SHARED METRICS
+# ----------------------------------------------------
+
+STAGE_SECONDS = histogram(
+    "shield_stage_seconds", "Time spent in each detection stage", ("stage",)
+)
+REQUEST_SECONDS = histogram(
+    "shield_request_seconds", "End-to-end HTTP request latency", ("endpoint",)
+)
+REQUESTS = counter(
+    "shield_requests_total", "HTTP requests by endpoint and status code", ("endpoint", "status")
+)
+OUTCOMES = counter(
+    "shield_detections_total", "Detection results by endpoint and outcome", ("endpoint", "outcome")
+)
+IN_FLIGHT = gauge(
+    "shield_in_flight_requests", "HTTP requests currently being handled", ("endpoint",)
+)
+INFERENCE_IN_FLIGHT = gauge(
+    "shield_inference_in_flight", "Jobs running or queued on the inference executor"
+)
+
+def record_outcome(endpoint: str, result) -> str:
+    """Count a detection result: metadata, ai, human, uncertain or error"""
+    if result is None or result.get("prediction") == "error":
+        outcome = "error"
+    elif result.get("method") == "metadata":
+        outcome = "metadata"
+    else:
+        outcome = result.get("prediction", "error")
+    OUTCOMES.inc(endpoint=endpoint, outcome=outcome)
+    return outcome
+
+# ----------------------------------------------------
+# STAGE TIMERS
+# ----------------------------------------------------
+# Every stage feeds the histogram. When the request opted into timings,
+# the milliseconds are also summed into the dict held by this context
+# variable (copy the context into executor threads to keep it).
+
+_request_timings = contextvars.ContextVar("shield_request_timings", default=None)
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a named detection stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed * 1000.0
+
+def timings_requested() -> bool:
+    return _request_timings.get() is not None
+
+@contextmanager
+def collect_timings(enabled: bool = True):
+    """Collect stage timings of the block into a fresh dict (yields None when disabled)"""
+    timings = {} if enabled else None
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+def with_timings(result, timings: dict = None):
+    """Copy of result with a rounded "timings" block (ms) if the request asked for one"""
+    timings = _request_timings.get() if timings is None else timings
+    if timings is None or result is None:
+        return result
+    return dict(result, timings={name: round(ms, 2) for name, ms in timings.items()})
+
+# ----------------------------------------------------
+# ASGI MIDDLEWARE
+# ----------------------------------------------------
+
+def _timings_flag(query_string: bytes) -> bool:
+    """True when the query string carries timings=1 (or timings=true)"""
+    values = parse_qs(query_string.decode("latin-1")).get("timings", [""])
+    return values[-1].lower() in ("1", "true")
+
+class MetricsMiddleware:
+    """
+    Request counters, latency and in-flight gauges per endpoint, and the
+    opt-in timings context. Plain ASGI so it adds no task hop per request.
+    Only paths in `endpoints` get their own label; the rest count as "other".
+    """
+
+    def __init__(self, app, endpoints=()):
+        self.app = app
+        self.endpoints = set(endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope.get("path", "")
+        endpoint = path if path in self.endpoints else "other"
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        enabled = (
+            _timings_flag(scope.get("query_string", b""))
+            or dict(scope.get("headers") or ()).get(TIMINGS_HEADER, b"") in (b"1", b"true")
+        )
+
+        started = time.perf_counter()
+        with IN_FLIGHT.track(endpoint=endpoint), collect_timings(enabled):
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+                REQUESTS.inc(endpoint=endpoint, status=status["code"])
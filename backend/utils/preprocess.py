@@ -0,0 +1,198 @@
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+# ----------------------------------------------------
+# FAST PREPROCESSING
+# ----------------------------------------------------
+# Replaces the per-call AutoImageProcessor: shrink early, then sharpen,
+# resize and normalize with torch ops straight into the model's input
+# tensor. On photos the output matches the processor within a few 1/255
+# steps (tools/parity.py reports the exact drift).
+
+# EXIF orientation tag -> transpose that undoes it
+_EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# Ensemble variations: the original, a slight rotation, a slight zoom
+# (crop from each edge and resize back) and a slight brightening
+ENSEMBLE_VARIANTS = ("original", "rotate", "zoom", "brightness")
+ROTATE_DEGREES = 1.0
+ZOOM_CROP = 0.01
+BRIGHTNESS_FACTOR = 1.05
+
+# PIL's ImageFilter.SMOOTH kernel, which ImageEnhance.Sharpness blends against
+_SMOOTH_KERNEL = torch.tensor([
+    [1.0, 1.0, 1.0],
+    [1.0, 5.0, 1.0],
+    [1.0, 1.0, 1.0],
+]) / 13.0
+
+
+def _size_hw(size) -> tuple:
+    """(height, width) from a processor size dict/SizeDict"""
+    height = getattr(size, "height", None) or size["height"]
+    width = getattr(size, "width", None) or size["width"]
+    return int(height), int(width)
+
+
+class FastPreprocessor:
+    """Vectorized stand-in for the HF image processor of the loaded model"""
+
+    # Keep this many times the model resolution before the final resize,
+    # so the high-quality resize still has detail to filter from
+    OVERSAMPLE = 2
+
+    def __init__(self, processor):
+        self.height, self.width = _size_hw(processor.size)
+        self.do_rescale = getattr(processor, "do_rescale", True)
+        self.rescale_factor = float(getattr(processor, "rescale_factor", 1 / 255))
+        self.do_normalize = getattr(processor, "do_normalize", True)
+        self.mean = torch.tensor(processor.image_mean, dtype=torch.float32).view(1, 3, 1, 1)
+        self.std = torch.tensor(processor.image_std, dtype=torch.float32).view(1, 3, 1, 1)
+        self.smooth = _SMOOTH_KERNEL.expand(3, 1, 3, 3).contiguous()
+
+    @property
+    def draft_size(self) -> tuple:
+        """Smallest (width, height) worth decoding a JPEG at"""
+        return (self.width * self.OVERSAMPLE, self.height * self.OVERSAMPLE)
+
+    def prepare(self, img: Image.Image) -> Image.Image:
+        """
+        RGB, EXIF orientation and integer downscale toward the model size
+        Cheap at any resolution: the reduce runs before any per-pixel work
+        """
+        orientation = 1
+        try:
+            orientation = img.getexif().get(0x0112, 1)
+        except Exception:
+            pass
+
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        target_w, target_h = self.draft_size
+        if orientation in (5, 6, 7, 8):
+            target_w, target_h = target_h, target_w
+
+        factor = min(img.width // target_w, img.height // target_h)
+        if factor >= 2:
+            img = img.reduce(factor)
+
+        transpose = _EXIF_TRANSPOSE.get(orientation)
+        if transpose is not None:
+            img = img.transpose(transpose)
+
+        return img
+
+    def __call__(self, images: list, sharpness: float = 1.0) -> torch.Tensor:
+        """Prepared PIL images -> normalized (N, 3, H, W) pixel_values"""
+        out = torch.empty((len(images), 3, self.height, self.width), dtype=torch.float32)
+
+        for i, img in enumerate(images):
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            pixels = torch.from_numpy(np.array(img)).permute(2, 0, 1).unsqueeze(0).float()
+
+            if sharpness != 1.0:
+                pixels = self._sharpen(pixels, sharpness)
+
+            out[i] = F.interpolate(
+                pixels, size=(self.height, self.width), mode="bicubic", antialias=True, align_corners=False
+            )[0]
+
+        out.clamp_(0.0, 255.0)
+        if self.do_rescale:
+            out.mul_(self.rescale_factor)
+        if self.do_normalize:
+            out.sub_(self.mean).div_(self.std)
+        return out
+
+    def _sharpen(self, pixels: torch.Tensor, factor: float) -> torch.Tensor:
+        """Same blend as ImageEnhance.Sharpness: smoothed + factor * (image - smoothed)"""
+        smoothed = F.conv2d(F.pad(pixels, (1, 1, 1, 1), mode="replicate"), self.smooth, groups=3)
+        return (smoothed + factor * (pixels - smoothed)).clamp_(0.0, 255.0)
+
+    # ------------------------------------------------
+    # Ensemble augmentation
+    # ------------------------------------------------
+    # Variations for ensemble voting, applied to the already resized and
+    # normalized input instead of rebuilding full-size PIL copies: the
+    # geometric ones share one batched affine_grid/grid_sample call.
+
+    def augment(self, pixel_values: torch.Tensor, variants=ENSEMBLE_VARIANTS, aspect: float = None) -> torch.Tensor:
+        """
+        One preprocessed image (1, 3, H, W) -> (len(variants), 3, H, W) pixel_values
+        aspect is the source image's width / height: the resize squashed
+        it to the model's shape, so a rotation has to be taken in the
+        source's proportions to match rotating the source
+        """
+        aspect = aspect or self.width / self.height
+        base = pixel_values.reshape(1, 3, self.height, self.width)
+        if self.do_normalize:
+            base = base * self.std + self.mean
+        white = 255.0 * self.rescale_factor if self.do_rescale else 255.0
+
+        theta = torch.zeros((len(variants), 2, 3), dtype=torch.float32)
+        theta[:, 0, 0] = theta[:, 1, 1] = 1.0
+        scale = torch.ones(len(variants), dtype=torch.float32)
+
+        for i, variant in enumerate(variants):
+            if variant == "rotate":
+                # Output -> input coordinates of PIL's counter-clockwise rotate
+                angle = math.radians(ROTATE_DEGREES)
+                cos, sin = math.cos(angle), math.sin(angle)
+                theta[i] = torch.tensor([
+                    [cos, -sin / aspect, 0.0],
+                    [sin * aspect, cos, 0.0],
+                ])
+            elif variant == "zoom":
+                theta[i, 0, 0] = theta[i, 1, 1] = 1.0 - 2 * ZOOM_CROP
+            elif variant == "brightness":
+                scale[i] = BRIGHTNESS_FACTOR
+
+        grid = F.affine_grid(theta, [len(variants), 3, self.height, self.width], align_corners=False)
+        # Sample (image - white) so the zero padding around a rotated image comes back white
+        out = F.grid_sample(
+            (base - white).expand(len(variants), -1, -1, -1), grid,
+            mode="bilinear", padding_mode="zeros", align_corners=False
+        ).add_(white)
+
+        out.mul_(scale.view(-1, 1, 1, 1)).clamp_(0.0, white)
+        if self.do_normalize:
+            out.sub_(self.mean).div_(self.std)
+        return out
+
+
+def compare_with_processor(fast: FastPreprocessor, processor, images: list, sharpness: float = 1.0) -> dict:
+    """
+    Max/mean absolute difference between the fast path and the HF processor
+    In normalized units; with mean/std 0.5 one 1/255 step is ~0.0078
+    """
+    from PIL import ImageEnhance
+
+    reference_inputs = []
+    for img in images:
+        img = img.convert("RGB")
+        if sharpness != 1.0:
+            img = ImageEnhance.Sharpness(img).enhance(sharpness)
+        reference_inputs.append(img)
+
+    reference = processor(images=reference_inputs, return_tensors="pt")["pixel_values"]
+    candidate = fast([fast.prepare(img) for img in images], sharpness=sharpness)
+    diff = (candidate - reference).abs()
+
+    return {
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean())
+    }
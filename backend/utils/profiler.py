@@ -0,0 +1,410 @@
+import asyncio
+import collections
+import hmac
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+
+from utils.admission import LANE_DEADLINE_MS
+from utils.logs import logger
+
+# ----------------------------------------------------
+# PROFILER CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# Set to 1 to expose the /debug/profile endpoints (404 otherwise)
+PROFILER_ENABLED = os.environ.get("SHIELD_PROFILER", "0") == "1"
+
+# Required with SHIELD_PROFILER=1: requests send it in the X-Shield-Profiler-Token
+# header (the endpoints return stack traces and start sampling runs)
+PROFILER_TOKEN = os.environ.get("SHIELD_PROFILER_TOKEN", "")
+
+if PROFILER_ENABLED and not PROFILER_TOKEN:
+    logger.warning("SHIELD_PROFILER=1 ignored: set SHIELD_PROFILER_TOKEN to enable /debug/*")
+    PROFILER_ENABLED = False
+
+# Requests slower than this keep a sampled profile (0 = off: no sampler thread, no middleware)
+SLOW_REQUEST_MS = float(os.environ.get("SHIELD_SLOW_REQUEST_MS", "0"))
+
+# Slow-request profiles kept for download (oldest dropped first)
+SLOW_PROFILES_KEPT = int(os.environ.get("SHIELD_SLOW_PROFILES_KEPT", "20"))
+
+# Sampling period of the always-on sampler used for slow requests, and of on-demand captures
+SLOW_SAMPLE_INTERVAL_MS = float(os.environ.get("SHIELD_SLOW_SAMPLE_INTERVAL_MS", "10"))
+CAPTURE_SAMPLE_INTERVAL_MS = 5.0
+
+# Longest on-demand capture
+MAX_CAPTURE_SECONDS = 60.0
+
+# How far back the always-on sampler remembers: the longest a request may
+# wait and run (a slower one keeps only its last SAMPLE_HISTORY_SECONDS)
+SAMPLE_HISTORY_SECONDS = max(LANE_DEADLINE_MS.values()) / 1000.0 + 1.0
+
+# Python frames kept per sample (innermost ones)
+MAX_STACK_DEPTH = 64
+
+# Distinct stacks shared between samples before the table is started over
+MAX_INTERNED_STACKS = 10000
+
+TOKEN_HEADER = "x-shield-profiler-token"
+
+# ----------------------------------------------------
+# STACK SAMPLER
+# ----------------------------------------------------
+# A daemon thread reads every other thread's current Python stack with
+# sys._current_frames(). Native work shows up under the Python frame
+# that called it (the model's forward, a PIL resize, a numpy op), which
+# is enough to tell PIL, numpy, preprocessing and torch time apart.
+# Threads parked in a wait (idle pool workers, the event loop's select)
+# are left out, so the stacks show where time is actually spent.
+
+# (file name, function) of innermost frames that mean "waiting, not working"
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+
+# Numbered pool threads share one root in the collapsed output
+_THREAD_NUMBER = re.compile(r"[_-]\d+$")
+
+
+class Sample:
+    __slots__ = ("time", "thread", "stack")
+
+    def __init__(self, when: float, thread: str, stack: tuple):
+        self.time = when
+        self.thread = thread
+        self.stack = stack
+
+
+# "file:function" label per code object, and one shared tuple per distinct
+# stack, so a busy server's samples mostly hold references to the same few
+_labels = {}
+_stacks = {}
+
+def _label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+    return label
+
+def _frame_stack(frame) -> tuple:
+    """Root-first "file:function" labels of a thread's current stack"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+
+    stack = tuple(labels)
+    shared = _stacks.get(stack)
+    if shared is None:
+        if len(_stacks) >= MAX_INTERNED_STACKS:
+            _stacks.clear()
+        shared = _stacks[stack] = stack
+    return shared
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES
+
+
+class StackSampler:
+    """
+    Background sampler of all threads' Python stacks
+    Runs only while someone holds it (acquire/release): the slow-request
+    capture for the life of the server, an on-demand capture for its
+    window. Samples are kept as long as the longest holder asks for.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}  # holder -> (interval, keep) in seconds
+        self._samples = collections.deque()
+        self._thread = None
+        self._stop = threading.Event()
+        self.ticks = 0
+
+    def acquire(self, holder, interval_ms: float, keep_seconds: float = SAMPLE_HISTORY_SECONDS):
+        with self._lock:
+            self._users[holder] = (max(0.001, interval_ms / 1000.0), keep_seconds)
+            if self._thread is None:
+                # A fresh stop event per thread: a stopping one may not have exited yet
+                self._stop = threading.Event()
+                self._samples.clear()
+                self._thread = threading.Thread(target=self._run, args=(self._stop,), name="shield-profiler", daemon=True)
+                self._thread.start()
+
+    def release(self, holder):
+        with self._lock:
+            self._users.pop(holder, None)
+            if not self._users and self._thread is not None:
+                self._stop.set()
+                self._thread = None
+
+    def samples_between(self, start: float, end: float) -> list:
+        """Samples taken in [start, end], walking back from the newest only as far as start"""
+        with self._lock:
+            window = []
+            for sample in reversed(self._samples):
+                if sample.time < start:
+                    break
+                if sample.time <= end:
+                    window.append(sample)
+        window.reverse()
+        return window
+
+    def _run(self, stop: threading.Event):
+        own = threading.get_ident()
+        thread_names = {}  # raw name -> name with the pool number stripped
+        while not stop.is_set():
+            started = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            taken = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own or _is_idle(frame):
+                    continue
+                name = names.get(ident, f"thread-{ident}")
+                thread = thread_names.get(name)
+                if thread is None:
+                    thread = thread_names[name] = _THREAD_NUMBER.sub("", name)
+                taken.append(Sample(started, thread, _frame_stack(frame)))
+
+            with self._lock:
+                if stop.is_set():
+                    return  # Released mid-tick: leave the samples to their readers
+                self._samples.extend(taken)
+                keep = max((keep for _, keep in self._users.values()), default=0.0)
+                horizon = started - keep
+                while self._samples and self._samples[0].time < horizon:
+                    self._samples.popleft()
+                self.ticks += 1
+                interval = min((interval for interval, _ in self._users.values()), default=0.0)
+
+            stop.wait(max(0.0, interval - (time.perf_counter() - started)))
+
+
+sampler = StackSampler()
+
+# ----------------------------------------------------
+# REPORTS
+# ----------------------------------------------------
+
+def collapse(samples: list) -> str:
+    """Collapsed stacks ("thread;frame;frame count" lines) for flamegraph.pl, speedscope, etc."""
+    counts = collections.Counter(";".join((sample.thread,) + sample.stack) for sample in samples)
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
+
+def summarize(samples: list, interval_ms: float, top: int = 25) -> dict:
+    """Share of samples per thread and per innermost frame (self time) and any frame (total time)"""
+    total = len(samples)
+    threads = collections.Counter(sample.thread for sample in samples)
+    self_time = collections.Counter(sample.stack[-1] for sample in samples if sample.stack)
+    total_time = collections.Counter(label for sample in samples for label in set(sample.stack))
+
+    def table(counter):
+        return [
+            {"frame": label, "samples": count, "percent": round(100.0 * count / total, 1)}
+            for label, count in counter.most_common(top)
+        ]
+
+    return {
+        "samples": total,
+        "interval_ms": interval_ms,
+        "threads": dict(threads.most_common()),
+        "self": table(self_time),
+        "total": table(total_time)
+    }
+
+# ----------------------------------------------------
+# ON-DEMAND CAPTURE
+# ----------------------------------------------------
+
+def _torch_profiler():
+    """torch.profiler over every thread (the inference threads aren't the caller's)"""
+    from torch.profiler import ProfilerActivity, profile
+
+    try:
+        from torch._C._profiler import _ExperimentalConfig
+        return profile(activities=[ProfilerActivity.CPU],
+                       experimental_config=_ExperimentalConfig(profile_all_threads=True))
+    except (ImportError, TypeError):
+        # Older torch: only ops run on the capturing thread are recorded
+        logger.warning("torch.profiler can't follow other threads here; operator table will be partial")
+        return profile(activities=[ProfilerActivity.CPU])
+
+_capture_lock = asyncio.Lock()
+_capture_ids = itertools.count(1)
+
+async def capture(seconds: float, with_torch: bool = False, interval_ms: float = CAPTURE_SAMPLE_INTERVAL_MS) -> dict:
+    """
+    Sample all threads for a window (and optionally record torch operators)
+    One capture at a time; the torch profiler adds overhead to every op
+    while it runs, the stack sampler only its own sampling.
+    """
+    seconds = max(0.1, min(float(seconds), MAX_CAPTURE_SECONDS))
+    if _capture_lock.locked():
+        raise RuntimeError("A capture is already running")
+
+    async with _capture_lock:
+        holder = ("capture", next(_capture_ids))
+        torch_profile = _torch_profiler() if with_torch else None
+
+        sampler.acquire(holder, interval_ms, keep_seconds=seconds + 1.0)
+        if torch_profile is not None:
+            torch_profile.__enter__()
+        started = time.perf_counter()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            ended = time.perf_counter()
+            if torch_profile is not None:
+                torch_profile.__exit__(None, None, None)
+            sampler.release(holder)
+
+    def build():
+        samples = sampler.samples_between(started, ended)
+        return {
+            "seconds": round(ended - started, 3),
+            "summary": summarize(samples, interval_ms),
+            "collapsed": collapse(samples)
+        }
+
+    report = await asyncio.get_running_loop().run_in_executor(None, build)
+    if torch_profile is not None:
+        averages = torch_profile.key_averages()
+        report["torch_ops"] = {
+            "by_self_cpu": averages.table(sort_by="self_cpu_time_total", row_limit=30),
+            "by_total_cpu": averages.table(sort_by="cpu_time_total", row_limit=30)
+        }
+    return report
+
+# ----------------------------------------------------
+# SLOW REQUESTS
+# ----------------------------------------------------
+
+class SlowRequestLog:
+    """
+    Bounded ring of sampled profiles of requests slower than the threshold
+    record() runs on the event loop when it is likely busiest, so it only
+    keeps the request's raw samples; report() summarizes them on demand.
+    """
+
+    def __init__(self, threshold_ms: float, kept: int):
+        self.threshold_ms = threshold_ms
+        self._entries = collections.deque(maxlen=max(1, kept))
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.captured = 0
+
+    def record(self, path: str, status: int, started: float, ended: float):
+        duration_ms = (ended - started) * 1000.0
+        if duration_ms < self.threshold_ms:
+            return
+
+        samples = sampler.samples_between(started, ended)
+        entry = {
+            "id": next(self._ids),
+            "path": path,
+            "status": status,
+            "duration_ms": round(duration_ms, 1),
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "samples": samples
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.captured += 1
+        logger.warning("Slow request %s: %.0fms (profile #%s)", path, duration_ms, entry['id'])
+
+    def list(self) -> list:
+        with self._lock:
+            return [
+                {key: value for key, value in entry.items() if key not in ("samples", "collapsed", "summary")}
+                for entry in self._entries
+            ]
+
+    def report(self, entry_id: int):
+        """
+        The entry with its summary and collapsed stacks, or None
+        Built on first request (blocking: call it off the event loop);
+        the raw samples are then replaced by the smaller report.
+        """
+        with self._lock:
+            entry = next((entry for entry in self._entries if entry["id"] == entry_id), None)
+            if entry is None or "samples" not in entry:
+                return entry
+            samples = entry["samples"]
+
+        summary = summarize(samples, SLOW_SAMPLE_INTERVAL_MS, top=10)
+        collapsed = collapse(samples)
+
+        with self._lock:
+            if entry.pop("samples", None) is not None:
+                entry["summary"] = summary
+                entry["collapsed"] = collapsed
+            return {key: value for key, value in entry.items() if key != "samples"}
+
+
+slow_requests = SlowRequestLog(SLOW_REQUEST_MS, SLOW_PROFILES_KEPT) if SLOW_REQUEST_MS > 0 else None
+
+
+class SlowRequestMiddleware:
+    """
+    Keeps a profile of every HTTP request slower than SLOW_REQUEST_MS
+    The sampler runs for the server's lifetime; a slow request gets the
+    samples of all threads taken while it was in flight, so on a busy
+    server they include its neighbours' work too. Only installed when
+    SLOW_REQUEST_MS is set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        sampler.acquire("slow-requests", SLOW_SAMPLE_INTERVAL_MS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith("/debug/"):
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            slow_requests.record(scope.get("path", ""), status["code"], started, time.perf_counter())
+
+# ----------------------------------------------------
+# ACCESS
+# ----------------------------------------------------
+
+def access_error(headers):
+    """None if this request may use the profiler, else (status, detail)"""
+    if not PROFILER_ENABLED:
+        return 404, "Not Found"
+    if not hmac.compare_digest(headers.get(TOKEN_HEADER, "").encode(), PROFILER_TOKEN.encode()):
+        return 403, "Profiler token required"
+    return None
+
+def stats() -> dict:
+    return {
+        "enabled": PROFILER_ENABLED,
+        "sampler_running": sampler._thread is not None,
+        "sampler_ticks": sampler.ticks,
+        "samples_kept": len(sampler._samples),
+        "sample_history_seconds": SAMPLE_HISTORY_SECONDS,
+        "slow_request_ms": SLOW_REQUEST_MS or None,
+        "slow_profiles_captured": slow_requests.captured if slow_requests is not None else 0
+    }
@@ -0,0 +1,342 @@
+import os
+import re
+import zlib
+from typing import NamedTuple, Optional
+
+# ----------------------------------------------------
+# PROVENANCE CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# Set to 0 to skip the raw-bytes scan (the decoded-image EXIF check still runs)
+PROVENANCE_SCAN = os.environ.get("SHIELD_PROVENANCE_SCAN", "1") == "1"
+
+# Bytes of a download scanned for metadata before giving up on the prefix
+PREFIX_SCAN_BYTES = 256 * 1024
+
+# Largest compressed PNG text chunk we inflate
+MAX_INFLATE_BYTES = 1024 * 1024
+
+# ----------------------------------------------------
+# INDICATOR MATCHING
+# ----------------------------------------------------
+# One precompiled alternation instead of a loop over indicator strings;
+# each indicator is its own group, so the group that matched names the
+# source reported to clients.
+
+# Distinctive enough to trust in any text (comments, captions, descriptions)
+_INDICATORS = [
+    (rb"midjourney", "Midjourney"),
+    (rb"\bdall(?:-|\xc2\xb7| )?e\b", "Dall-E"),
+    (rb"stable ?diffusion", "Stable Diffusion"),
+    (rb"adobe firefly|\bfirefly image ?\d", "Firefly"),
+    (rb"google imagen", "Imagen"),
+    (rb"\bflux\.1|\bflux[ -]1\.\d|\bflux[ .-]?(?:schnell|kontext)\b|black forest labs", "Flux"),
+    (rb"dreamstudio", "Dreamstudio"),
+    (rb"leonardo\.ai", "Leonardo.Ai"),
+    (rb"nightcafe", "Nightcafe"),
+    (rb"artbreeder", "Artbreeder"),
+    (rb"craiyon", "Craiyon"),
+    (rb"bluewillow", "Bluewillow"),
+    (rb"novelai", "NovelAI"),
+    (rb"comfyui", "ComfyUI"),
+    (rb"invokeai", "InvokeAI"),
+    # IPTC DigitalSourceType used by XMP and C2PA for generated media
+    (rb"trainedalgorithmicmedia", "AI Generated (IPTC digital source type)"),
+]
+
+# Ordinary words ("una imagen", "imagen 2 de 10", "heat flux"); only
+# trusted in fields that name the tool that made the file (EXIF Software,
+# XMP CreatorTool, C2PA softwareAgent / claim_generator, PNG Software)
+_GENERATOR_INDICATORS = [
+    (rb"\bfirefly\b", "Firefly"),
+    (rb"\bimagen\b|\bimagen ?\d", "Imagen"),
+    (rb"\bflux\b", "Flux"),
+]
+
+# Only trusted inside C2PA manifests (too common as plain words elsewhere)
+_C2PA_INDICATORS = [
+    (rb"\bopenai\b", "OpenAI"),
+    (rb"chatgpt", "ChatGPT"),
+]
+
+def _compile(indicators):
+    pattern = re.compile(b"|".join(b"(" + regex + b")" for regex, _ in indicators), re.IGNORECASE)
+    return pattern, [source for _, source in indicators]
+
+INDICATOR_PATTERN, _SOURCES = _compile(_INDICATORS)
+GENERATOR_PATTERN, _GENERATOR_SOURCES = _compile(_INDICATORS + _GENERATOR_INDICATORS)
+C2PA_PATTERN, _C2PA_SOURCES = _compile(_INDICATORS + _C2PA_INDICATORS)
+
+def match_indicator(data: bytes, c2pa=False, generator=False) -> Optional[str]:
+    """
+    Source name of the first AI indicator in data, or None
+    generator=True when data is a generator field (the tool that wrote
+    the file), which also trusts generic names like "Flux".
+    """
+    if generator:
+        pattern, sources = GENERATOR_PATTERN, _GENERATOR_SOURCES
+    elif c2pa:
+        pattern, sources = C2PA_PATTERN, _C2PA_SOURCES
+    else:
+        pattern, sources = INDICATOR_PATTERN, _SOURCES
+    match = pattern.search(data)
+    if match is None:
+        return None
+    return sources[match.lastindex - 1]
+
+def _match_text_and_utf16(data: bytes) -> Optional[str]:
+    """EXIF strings may be UTF-16 (UserComment "UNICODE", XP* tags)"""
+    source = match_indicator(data)
+    if source is None and b"\x00" in data:
+        for offset in (0, 1):
+            text = data[offset:].decode("utf-16-le", "ignore").encode("utf-8", "ignore")
+            source = match_indicator(text)
+            if source:
+                break
+    return source
+
+# ----------------------------------------------------
+# RAW-BYTES CONTAINER WALKERS
+# ----------------------------------------------------
+# Each walker returns ([(field, bytes)], complete). complete is False when
+# data ends before the metadata section does, so a longer prefix may still
+# hold a match.
+
+_XMP_PREFIX = b"http://ns.adobe.com/xap/1.0/\x00"
+
+def _jpeg_segments(data: bytes):
+    segments = []
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return segments, True  # Not a marker: corrupt, nothing more to read
+
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1  # Fill byte
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker in (0xDA, 0xD9):
+            return segments, True  # Start of scan: metadata is all before this
+
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+        if end > len(data):
+            return segments, False
+
+        payload = data[pos + 4:end]
+        if marker == 0xE1:
+            segments.append(("xmp" if payload.startswith(_XMP_PREFIX) else "exif", payload))
+        elif marker == 0xEB:
+            segments.append(("c2pa", payload))  # APP11: JUMBF boxes
+        elif marker == 0xED:
+            segments.append(("iptc", payload))
+        elif marker == 0xFE:
+            segments.append(("comment", payload))
+        pos = end
+
+    return segments, False
+
+def _inflate(data: bytes) -> bytes:
+    try:
+        return zlib.decompressobj().decompress(data, MAX_INFLATE_BYTES)
+    except zlib.error:
+        return b""
+
+def _png_text(chunk_type: bytes, payload: bytes):
+    """(keyword, text) of a tEXt/zTXt/iTXt chunk"""
+    keyword, _, rest = payload.partition(b"\x00")
+    if chunk_type == b"tEXt":
+        return keyword, rest
+    if chunk_type == b"zTXt":
+        return keyword, _inflate(rest[1:])
+
+    # iTXt: compression flag, method, language\0, translated keyword\0, text
+    if len(rest) < 2:
+        return keyword, b""
+    compressed, rest = rest[0], rest[2:]
+    _, _, rest = rest.partition(b"\x00")
+    _, _, text = rest.partition(b"\x00")
+    return keyword, _inflate(text) if compressed else text
+
+def _png_segments(data: bytes):
+    segments = []
+    pos = 8
+    while pos + 8 <= len(data):
+        length = int.from_bytes(data[pos:pos + 4], "big")
+        chunk_type = data[pos + 4:pos + 8]
+        if chunk_type == b"IDAT":
+            return segments, True  # Text chunks that matter come before the pixels
+
+        end = pos + 12 + length
+        if end > len(data):
+            return segments, False
+
+        payload = data[pos + 8:pos + 8 + length]
+        if chunk_type in (b"tEXt", b"zTXt", b"iTXt"):
+            keyword, text = _png_text(chunk_type, payload)
+            segments.append(("png:" + keyword.decode("latin-1", "replace"), text))
+        elif chunk_type == b"eXIf":
+            segments.append(("exif", payload))
+        elif chunk_type == b"caBX":
+            segments.append(("c2pa", payload))
+        elif chunk_type == b"IEND":
+            return segments, True
+        pos = end
+
+    return segments, False
+
+def _webp_segments(data: bytes):
+    segments = []
+    pos = 12
+    while pos + 8 <= len(data):
+        fourcc = data[pos:pos + 4]
+        length = int.from_bytes(data[pos + 4:pos + 8], "little")
+        end = pos + 8 + length + (length & 1)
+
+        if fourcc in (b"EXIF", b"XMP ", b"C2PA"):
+            if pos + 8 + length > len(data):
+                return segments, False
+            field = {b"EXIF": "exif", b"XMP ": "xmp", b"C2PA": "c2pa"}[fourcc]
+            segments.append((field, data[pos + 8:pos + 8 + length]))
+        pos = end
+
+    # WebP keeps EXIF/XMP after the image data, so only the whole file is conclusive
+    return segments, len(data) >= 8 + int.from_bytes(data[4:8], "little")
+
+def metadata_segments(data: bytes):
+    """Metadata blocks found in the (possibly partial) file: ([(field, bytes)], complete)"""
+    if data.startswith(b"\xff\xd8"):
+        return _jpeg_segments(data)
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return _png_segments(data)
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return _webp_segments(data)
+    return [], len(data) >= 12  # Other formats: nothing we read
+
+# ----------------------------------------------------
+# GENERATOR FIELDS
+# ----------------------------------------------------
+# The fields that name the software that wrote the file. Generic tool
+# names ("Flux", "Imagen", "Firefly") are only trusted here.
+
+_XMP_GENERATOR = re.compile(rb"(?:CreatorTool|softwareAgent)(?:\s*=\s*[\"']([^\"']*)|>([^<]*)<)")
+_C2PA_GENERATOR = re.compile(rb"softwareAgent|claim_generator")
+
+# Bytes read after a C2PA generator key whose value isn't a plain CBOR string
+C2PA_GENERATOR_WINDOW = 96
+
+def exif_software(payload: bytes) -> bytes:
+    """EXIF Software (0x0131) string of a raw EXIF/TIFF block, or b"" """
+    if payload.startswith(b"Exif\x00\x00"):
+        payload = payload[6:]
+    order = {b"II": "little", b"MM": "big"}.get(payload[:2])
+    if order is None or len(payload) < 8:
+        return b""
+
+    ifd = int.from_bytes(payload[4:8], order)
+    count = int.from_bytes(payload[ifd:ifd + 2], order)
+    for entry in range(ifd + 2, ifd + 2 + 12 * count, 12):
+        if entry + 12 > len(payload):
+            break
+        if int.from_bytes(payload[entry:entry + 2], order) != 0x0131:
+            continue
+        length = int.from_bytes(payload[entry + 4:entry + 8], order)
+        if length <= 4:
+            return payload[entry + 8:entry + 8 + length]
+        offset = int.from_bytes(payload[entry + 8:entry + 12], order)
+        return payload[offset:offset + length]
+    return b""
+
+def _c2pa_generators(payload: bytes) -> list:
+    """Values of softwareAgent / claim_generator keys in CBOR-encoded C2PA claims"""
+    values = []
+    for match in _C2PA_GENERATOR.finditer(payload):
+        pos = match.end()
+        header = payload[pos:pos + 1]
+        if header and 0x60 <= header[0] <= 0x77:  # Short text string
+            values.append(payload[pos + 1:pos + 1 + header[0] - 0x60])
+        elif header == b"\x78":  # Text string, one length byte
+            length = payload[pos + 1] if pos + 1 < len(payload) else 0
+            values.append(payload[pos + 2:pos + 2 + length])
+        else:  # ClaimGeneratorInfo map, JSON, ...: the bytes just after the key
+            values.append(payload[pos:pos + C2PA_GENERATOR_WINDOW])
+    return values
+
+def _generator_fields(field: str, payload: bytes) -> list:
+    if field == "exif":
+        return [exif_software(payload)]
+    if field == "xmp":
+        return [b"".join(groups) for groups in _XMP_GENERATOR.findall(payload)]
+    if field == "c2pa":
+        return _c2pa_generators(payload)
+    if field.lower() == "png:software":
+        return [payload]
+    return []
+
+# ----------------------------------------------------
+# SCANNER
+# ----------------------------------------------------
+
+class ProvenanceResult(NamedTuple):
+    """source/field are set on a match; complete means more bytes can't change the answer"""
+    source: Optional[str]
+    field: Optional[str]
+    complete: bool
+
+
+def _match_segment(field: str, payload: bytes) -> Optional[str]:
+    for value in _generator_fields(field, payload):
+        source = match_indicator(value, generator=True)
+        if source:
+            return source
+
+    if field == "c2pa":
+        return match_indicator(payload, c2pa=True)
+
+    if field.startswith("png:"):
+        keyword = field[4:].lower()
+        # Generator parameters rarely name the tool, but their shape does
+        if keyword == "parameters" and b"Steps:" in payload and b"Sampler:" in payload:
+            return "Stable Diffusion"
+        if keyword in ("prompt", "workflow") and b"class_type" in payload:
+            return "ComfyUI"
+        if keyword in ("invokeai_metadata", "sd-metadata", "dream"):
+            return "InvokeAI"
+        return match_indicator(payload) or match_indicator(field[4:].encode("latin-1", "replace"))
+
+    if field == "exif":
+        return _match_text_and_utf16(payload)
+
+    return match_indicator(payload)
+
+def scan_provenance(data: bytes) -> ProvenanceResult:
+    """
+    Look for AI-generation markers in a file's raw bytes without decoding it
+    Reads EXIF, XMP, JPEG comments/IPTC, PNG tEXt/zTXt/iTXt (Stable
+    Diffusion/ComfyUI parameters) and C2PA/JUMBF manifests in JPEG, PNG
+    and WebP. Works on a prefix of the file.
+    """
+    try:
+        segments, complete = metadata_segments(bytes(data))
+    except Exception:
+        return ProvenanceResult(None, None, True)
+
+    for field, payload in segments:
+        source = _match_segment(field, payload)
+        if source:
+            return ProvenanceResult(source, field, True)
+
+    return ProvenanceResult(None, None, complete)
+
+def scan_image_info(info: dict) -> Optional[str]:
+    """Match the text metadata Pillow exposes in img.info (PNG text chunks, XMP)"""
+    for key, value in info.items():
+        if key in ("exif", "icc_profile") or not isinstance(value, (str, bytes)):
+            continue
+        payload = value.encode("utf-8", "ignore") if isinstance(value, str) else value
+        source = _match_segment("xmp" if key in ("xmp", "XML:com.adobe.xmp") else "png:" + str(key), payload)
+        if source:
+            return source
+    return None
@@ -0,0 +1,148 @@
+import json
+import math
+import os
+import platform
+import time
+
+# ----------------------------------------------------
+# TUNING PROFILE CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# Profile written by tools/autotune.py and loaded at boot ("" = don't load one)
+PROFILE_PATH = os.environ.get(
+    "SHIELD_PROFILE",
+    os.path.join(os.path.expanduser("~"), ".cache", "shield", "tuning.json")
+)
+
+# Profile setting -> the SHIELD_* variable it provides a default for
+# (an explicitly set variable always wins over the profile)
+PROFILE_SETTINGS = {
+    "torch_threads": "SHIELD_TORCH_THREADS",
+    "interop_threads": "SHIELD_INTEROP_THREADS",
+    "batch_max_size": "SHIELD_BATCH_MAX_SIZE",
+    "batch_max_wait_ms": "SHIELD_BATCH_MAX_WAIT_MS",
+}
+
+PROFILE_VERSION = 1
+
+# ----------------------------------------------------
+# MACHINE FINGERPRINT
+# ----------------------------------------------------
+# A profile is only valid on the kind of machine it was measured on: the
+# CPUs this process may use (affinity and container CPU quota) and the
+# inference engine it drove.
+
+def _cgroup_cpu_limit():
+    """CPUs allowed by the container's CPU quota, or None when unlimited"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+def usable_cpus() -> int:
+    """Cores this process can actually keep busy (affinity, capped by the CPU quota)"""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return cpus
+
+def machine_fingerprint(engine: str, model: str) -> dict:
+    return {
+        "usable_cpus": usable_cpus(),
+        "cpu_count": os.cpu_count(),
+        "machine": platform.machine(),
+        "engine": engine,
+        "model": model
+    }
+
+# ----------------------------------------------------
+# LOADING
+# ----------------------------------------------------
+
+_status = {"path": None, "applied": {}, "overridden": [], "skipped": None, "created": None, "loaded": False}
+
+def save_profile(path: str, settings: dict, fingerprint: dict, extra: dict = None):
+    """Write a profile (atomically, so a booting server never reads half of one)"""
+    profile = dict(
+        extra or {},
+        version=PROFILE_VERSION,
+        created=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        machine=fingerprint,
+        settings={key: settings[key] for key in PROFILE_SETTINGS if key in settings}
+    )
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+
+def apply_profile(path: str = PROFILE_PATH) -> dict:
+    """
+    Turn the saved profile into SHIELD_* defaults; call before importing
+    the modules that read them (utils.detector, main)
+    A profile measured on a different CPU budget or engine is skipped.
+    Only the first call in a process does anything; the outcome is
+    reported by profile_status().
+    """
+    if _status["loaded"]:
+        return profile_status()
+    _status.update(path=path or None, loaded=True)
+    if not path or not os.path.exists(path):
+        return profile_status()
+
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except (OSError, ValueError) as e:
+        _status["skipped"] = f"unreadable: {e}"
+        return profile_status()
+
+    machine = profile.get("machine") or {}
+    expected = {
+        "usable_cpus": usable_cpus(),
+        "engine": os.environ.get("SHIELD_ENGINE", "torch")
+    }
+    for key, value in expected.items():
+        if machine.get(key) is not None and machine[key] != value:
+            _status["skipped"] = f"made for {key}={machine[key]}, running with {value}"
+            return profile_status()
+
+    _status["created"] = profile.get("created")
+    for key, value in (profile.get("settings") or {}).items():
+        variable = PROFILE_SETTINGS.get(key)
+        if variable is None:
+            continue
+        if variable in os.environ:
+            _status["overridden"].append(key)
+        else:
+            os.environ[variable] = str(value)
+            _status["applied"][key] = value
+    return profile_status()
+
+def profile_status() -> dict:
+    """Which profile was loaded and which of its settings took effect (for /config)"""
+    return {
+        "path": _status["path"],
+        "created": _status["created"],
+        "applied": dict(_status["applied"]),
+        "overridden_by_env": list(_status["overridden"]),
+        "skipped": _status["skipped"]
+    }
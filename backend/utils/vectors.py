@@ -0,0 +1,254 @@
+import array
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, no file locking needed
+    fcntl = None
+
+# ----------------------------------------------------
+# NEAR-DUPLICATE INDEX CONFIGURATION (TUNABLE)
+# ----------------------------------------------------
+
+# Set to 1 to reuse verdicts of near-duplicate images. Off by default: the
+# distance below is not calibrated for the model's (anisotropic) pooled
+# features, so check true duplicates vs. unrelated images before enabling
+NEAR_DUP_ENABLED = os.environ.get("SHIELD_NEAR_DUP", "0") == "1"
+
+# Largest cosine distance between embeddings still treated as the same image
+NEAR_DUP_DISTANCE = float(os.environ.get("SHIELD_NEAR_DUP_DISTANCE", "0.03"))
+
+# Directory for the vector file and verdicts, kept across restarts
+# (empty = a temporary directory removed on exit)
+VECTOR_DIR = os.environ.get("SHIELD_VECTOR_DIR", "")
+
+# Most images indexed; once full, new verdicts are no longer added
+NEAR_DUP_MAX_ENTRIES = int(os.environ.get("SHIELD_NEAR_DUP_MAX_ENTRIES", "100000"))
+
+# LSH layout: more tables find more true neighbours, more bits make buckets smaller
+LSH_TABLES = 8
+LSH_BITS = 12
+
+# Rows added to the vector file each time it fills up
+GROW_ROWS = 4096
+
+# ----------------------------------------------------
+# VECTOR STORE + LSH INDEX
+# ----------------------------------------------------
+# Embeddings are L2-normalized and appended as float16 rows to a
+# memory-mapped file; the verdict for row i is line i of a JSONL file
+# next to it, read back only on a match (memory holds just its offset).
+# Lookups hash the query with random hyperplanes (one bucket per table),
+# then compare it exactly against the rows in those buckets.
+# Pre-forked workers share the files: appends take an flock, and each
+# process picks up rows the others added before it searches.
+
+class NearDuplicate(NamedTuple):
+    row: int
+    distance: float
+    verdict: dict
+
+
+class NearDuplicateIndex:
+    """Append-only float16 embedding store with an approximate nearest-neighbour lookup"""
+
+    def __init__(self, dim: int, namespace: str = "", directory: str = VECTOR_DIR,
+                 max_distance: float = NEAR_DUP_DISTANCE, max_entries: int = NEAR_DUP_MAX_ENTRIES,
+                 seed: int = 0):
+        self.dim = int(dim)
+        self.max_distance = max_distance
+        self.max_entries = max(1, int(max_entries))
+
+        if not directory:
+            directory = tempfile.mkdtemp(prefix="shield-vectors-")
+            owner = os.getpid()
+            atexit.register(lambda: os.getpid() == owner and shutil.rmtree(directory, ignore_errors=True))
+        os.makedirs(directory, exist_ok=True)
+
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in namespace) or "default"
+        self.vector_path = os.path.join(directory, f"{name}-{self.dim}.f16")
+        self.verdict_path = os.path.join(directory, f"{name}-{self.dim}.jsonl")
+
+        # Same seed -> same hyperplanes, so the index rebuilds identically on load
+        planes = np.random.default_rng(seed).standard_normal((LSH_TABLES * LSH_BITS, self.dim))
+        self._planes = planes.astype(np.float32)
+        self._powers = (1 << np.arange(LSH_BITS)).astype(np.int64)
+
+        self._lock = threading.Lock()
+        self._pid = None
+
+        # Stats
+        self._hits = 0
+        self._misses = 0
+
+    # ------------------------------------------------
+    # Public API
+    # ------------------------------------------------
+
+    def nearest(self, embedding) -> Optional[NearDuplicate]:
+        """Closest stored embedding within max_distance, or None"""
+        query = self._normalize(embedding)
+        with self._lock:
+            self._sync()
+            keys = self._hash(query[None, :])[0]
+            candidates = set()
+            for table, key in zip(self._tables, keys):
+                candidates.update(table.get(int(key), ()))
+
+            match = None
+            if candidates:
+                rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+                distances = 1.0 - self._vectors[rows].astype(np.float32) @ query
+                best = int(np.argmin(distances))
+                if distances[best] <= self.max_distance:
+                    row = int(rows[best])
+                    match = NearDuplicate(row, float(distances[best]), self._verdict(row))
+
+            if match is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return match
+
+    def add(self, embedding, verdict: dict) -> Optional[int]:
+        """Append an embedding and its verdict; returns the row (None once the index is full)"""
+        vector = self._normalize(embedding)
+        line = (json.dumps(verdict, separators=(",", ":")) + "\n").encode("utf-8")
+
+        with self._lock:
+            self._sync()
+            if self._count >= self.max_entries:
+                return None
+            if fcntl is not None:
+                fcntl.flock(self._verdict_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have appended since we last looked
+                self._sync()
+                row = self._count
+                if row >= self.max_entries:
+                    return None
+                if row >= len(self._vectors):
+                    self._grow(row + GROW_ROWS)
+
+                # Vector before verdict: a reader that sees the line sees the row
+                self._vectors[row] = vector
+                self._verdict_file.seek(0, os.SEEK_END)
+                self._verdict_file.write(line)
+                self._verdict_file.flush()
+                start = self._offset
+                self._offset += len(line)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._verdict_file, fcntl.LOCK_UN)
+
+            self._index(row, vector, start)
+            return row
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": self._count if self._pid is not None else 0,
+                "dim": self.dim,
+                "max_distance": self.max_distance,
+                "max_entries": self.max_entries,
+                "path": self.vector_path,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": (self._hits / lookups) if lookups else 0.0
+            }
+
+    # ------------------------------------------------
+    # Storage
+    # ------------------------------------------------
+
+    def _open(self):
+        """(Re)open the files in this process; forked workers need their own descriptors and locks"""
+        self._verdict_file = open(self.verdict_path, "a+b")
+        if not os.path.exists(self.vector_path):
+            open(self.vector_path, "ab").close()
+        self._map_vectors()
+
+        self._count = 0
+        self._offset = 0
+        self._line_offsets = array.array("q")
+        self._tables = [dict() for _ in range(LSH_TABLES)]
+        self._pid = os.getpid()
+
+    def _map_vectors(self):
+        rows = os.path.getsize(self.vector_path) // (2 * self.dim)
+        if rows == 0:
+            self._grow(GROW_ROWS)
+            return
+        self._vectors = np.memmap(self.vector_path, dtype=np.float16, mode="r+", shape=(rows, self.dim))
+
+    def _grow(self, rows: int):
+        with open(self.vector_path, "r+b") as f:
+            f.truncate(max(rows, 1) * 2 * self.dim)
+        self._map_vectors()
+
+    def _sync(self):
+        """Index verdict lines appended since the last call (by any process)"""
+        if self._pid != os.getpid():
+            self._open()
+
+        size = os.path.getsize(self.verdict_path)
+        if size <= self._offset:
+            return
+        if self._count >= self.max_entries:
+            self._offset = size  # Rows past the cap (an index built with a larger one) stay unindexed
+            return
+
+        self._verdict_file.seek(self._offset)
+        data = self._verdict_file.read(size - self._offset)
+        end = data.rfind(b"\n") + 1  # Only whole lines; a partial one is still being written
+        if not end:
+            return
+
+        lines = data[:end].splitlines(keepends=True)[:self.max_entries - self._count]
+        if self._count + len(lines) > len(self._vectors):
+            self._map_vectors()
+
+        rows = np.arange(self._count, self._count + len(lines))
+        vectors = self._vectors[rows].astype(np.float32)
+        start = self._offset
+        for row, vector, line in zip(rows, vectors, lines):
+            self._index(int(row), vector, start)
+            start += len(line)
+        self._offset = start if self._count < self.max_entries else size
+
+    def _index(self, row: int, vector: np.ndarray, line_offset: int):
+        keys = self._hash(vector[None, :].astype(np.float32))[0]
+        for table, key in zip(self._tables, keys):
+            table.setdefault(int(key), []).append(row)
+        self._line_offsets.append(line_offset)
+        self._count = row + 1
+
+    def _verdict(self, row: int) -> dict:
+        """Stored verdict of a row, read back from the JSONL file"""
+        self._verdict_file.seek(self._line_offsets[row])
+        return json.loads(self._verdict_file.readline())
+
+    # ------------------------------------------------
+    # Hashing
+    # ------------------------------------------------
+
+    def _normalize(self, embedding) -> np.ndarray:
+        if hasattr(embedding, "detach"):
+            embedding = embedding.detach().cpu().numpy()
+        vector = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def _hash(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, dim) -> (n, LSH_TABLES) bucket keys, one sign bit per hyperplane"""
+        bits = (vectors @ self._planes.T > 0).reshape(len(vectors), LSH_TABLES, LSH_BITS)
+        return bits.astype(np.int64) @ self._powers
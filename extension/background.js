@@ -3,6 +3,330 @@ const pendingRequests = new Map();
 const requestCache = new Map();
 const CACHE_DURATION = 60000; // 1 minute cache
 
+const BACKEND_URL = "http://127.0.0.1:8000";
+const CHANNEL_URL = "ws://127.0.0.1:8000/ws";
+
+// ----------------------------------------------------
+// SCAN CHANNEL (one long-lived WebSocket to the backend)
+// ----------------------------------------------------
+// Scans are multiplexed over the socket by id and results are pushed back
+// as they finish. A superseded hover is cancelled, so the backend drops it
+// before inference. While the socket is down, scans fall back to HTTP and
+// the socket reconnects with exponential backoff.
+
+const RECONNECT_MIN_DELAY = 500;
+const RECONNECT_MAX_DELAY = 30000;
+const PING_INTERVAL = 20000; // Socket traffic also keeps the service worker alive
+
+let channel = null;
+let channelOutbox = [];
+let reconnectDelay = RECONNECT_MIN_DELAY;
+let reconnectTimer = null;
+let pingTimer = null;
+let nextScanId = 1;
+const channelScans = new Map(); // scan id -> { resolve, reject }
+
+// Latest hover scan per tab, cancelled when the user moves to another image
+const hoverScans = new Map(); // tab id -> { id, url }
+
+function connectChannel() {
+    if (channel || reconnectTimer) return;
+
+    let socket;
+    try {
+        socket = new WebSocket(CHANNEL_URL);
+    } catch (err) {
+        scheduleReconnect();
+        return;
+    }
+    channel = socket;
+
+    socket.onopen = () => {
+        reconnectDelay = RECONNECT_MIN_DELAY;
+        channelOutbox.forEach(frame => socket.send(frame));
+        channelOutbox = [];
+        pingTimer = setInterval(() => socket.send(JSON.stringify({ type: "ping" })), PING_INTERVAL);
+    };
+
+    socket.onmessage = (event) => {
+        let frame;
+        try {
+            frame = JSON.parse(event.data);
+        } catch (err) {
+            return;
+        }
+
+        const scan = channelScans.get(frame.id);
+        if (!scan || (frame.type !== "result" && frame.type !== "error")) return;
+
+        channelScans.delete(frame.id);
+        scan.resolve(frame);
+    };
+
+    socket.onclose = () => {
+        if (channel === socket) channel = null;
+        clearInterval(pingTimer);
+        channelOutbox = [];
+
+        // Scans still on the socket are retried over HTTP by their callers
+        for (const [id, scan] of channelScans.entries()) {
+            channelScans.delete(id);
+            scan.reject(new Error("Scan channel closed"));
+        }
+
+        scheduleReconnect();
+    };
+}
+
+function scheduleReconnect() {
+    if (reconnectTimer) return;
+
+    // Jitter so many browsers don't reconnect in lockstep after a restart
+    const delay = reconnectDelay * (0.5 + Math.random() / 2);
+    reconnectDelay = Math.min(reconnectDelay * 2, RECONNECT_MAX_DELAY);
+
+    reconnectTimer = setTimeout(() => {
+        reconnectTimer = null;
+        connectChannel();
+    }, delay);
+}
+
+// Send a scan over the channel; resolves with its result/error frame,
+// rejects when the channel is unavailable or closes first
+function channelScan(fields) {
+    connectChannel();
+    if (!channel) {
+        return { id: null, promise: Promise.reject(new Error("Scan channel unavailable")) };
+    }
+
+    const id = nextScanId++;
+    const frame = JSON.stringify(Object.assign({ type: "scan", id: id }, fields));
+    const promise = new Promise((resolve, reject) => channelScans.set(id, { resolve, reject }));
+
+    if (channel.readyState === WebSocket.OPEN) {
+        channel.send(frame);
+    } else {
+        channelOutbox.push(frame);
+    }
+    return { id: id, promise: promise };
+}
+
+function cancelChannelScan(id) {
+    const scan = channelScans.get(id);
+    if (!scan) return;
+
+    channelScans.delete(id);
+    if (channel && channel.readyState === WebSocket.OPEN) {
+        channel.send(JSON.stringify({ type: "cancel", id: id }));
+    }
+    scan.resolve({ type: "cancelled", id: id });
+}
+
+// Page scans share the socket with hovers, so only a few go out at once:
+// the backend refuses scans past its per-connection limit and sheds bulk
+// work past a short queue. Refused scans (429/503) are retried after the
+// backend's retry_after, and halve the number sent at once (it grows back
+// by one per result).
+const BULK_IN_FLIGHT = 8;
+const BULK_RETRIES = 3;
+
+let bulkLimit = BULK_IN_FLIGHT;
+let bulkInFlight = 0;
+const bulkQueue = []; // { fields, attempts, resolve, reject }
+
+// channelScan for page scans: queued, throttled and retried when shed
+function bulkChannelScan(fields) {
+    return new Promise((resolve, reject) => {
+        bulkQueue.push({ fields: fields, attempts: 0, resolve: resolve, reject: reject });
+        pumpBulkScans();
+    });
+}
+
+function pumpBulkScans() {
+    while (bulkInFlight < bulkLimit && bulkQueue.length > 0) {
+        const job = bulkQueue.shift();
+        bulkInFlight++;
+
+        channelScan(job.fields).promise
+        .then(frame => {
+            bulkInFlight--;
+            const shed = frame.type === "error" && (frame.status === 429 || frame.status === 503);
+            bulkLimit = shed ? Math.max(1, Math.floor(bulkLimit / 2)) : Math.min(BULK_IN_FLIGHT, bulkLimit + 1);
+            if (shed && job.attempts < BULK_RETRIES) {
+                job.attempts++;
+                setTimeout(() => {
+                    bulkQueue.push(job);
+                    pumpBulkScans();
+                }, (frame.retry_after || 1) * 1000);
+            } else {
+                job.resolve(frame);
+            }
+            pumpBulkScans();
+        }, err => {
+            bulkInFlight--;
+            job.reject(err);
+            pumpBulkScans();
+        });
+    }
+}
+
+// Detection result for a channel frame, in the same shape as the HTTP endpoints
+function resultFromFrame(frame) {
+    if (frame.type === "error") {
+        return errorResult(frame.error || `HTTP ${frame.status}`);
+    }
+    const { type, id, ...data } = frame;
+    return data;
+}
+
+function errorResult(message) {
+    return {
+        prediction: "error",
+        ai_probability: 0,
+        human_probability: 0,
+        error: message
+    };
+}
+
+// Hover scan over HTTP (when the channel is down)
+async function fetchDetect(url) {
+    const res = await fetch(`${BACKEND_URL}/detect`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ url: url })
+    });
+
+    if (!res.ok) {
+        throw new Error(`HTTP ${res.status}`);
+    }
+    return res.json();
+}
+
+connectChannel();
+
+// Send many URLs in one request; results stream back as NDJSON lines
+async function streamBatch(urls, ensemble, onResult) {
+    const res = await fetch(`${BACKEND_URL}/detect/batch`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+            items: urls.map(url => ({ url: url })),
+            ensemble: ensemble
+        })
+    });
+
+    if (!res.ok) {
+        throw new Error(`HTTP ${res.status}`);
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+
+        lines.filter(line => line.trim()).forEach(line => onResult(JSON.parse(line)));
+    }
+
+    if (buffer.trim()) {
+        onResult(JSON.parse(buffer));
+    }
+}
+
+// ----------------------------------------------------
+// UPLOADS (downscaled to what the model actually uses)
+// ----------------------------------------------------
+
+const SMALL_UPLOAD_BYTES = 256 * 1024; // Sent as-is: a copy wouldn't save much
+const PROVENANCE_PREFIX_BYTES = 256 * 1024; // Head of a file the backend scans for generator metadata
+
+let uploadSizePromise = null;
+
+// Smallest [width, height] worth uploading, from the backend's /config
+// (null until the model is loaded; asked again next time)
+function getUploadSize() {
+    if (!uploadSizePromise) {
+        uploadSizePromise = fetch(`${BACKEND_URL}/config`)
+            .then(res => res.ok ? res.json() : null)
+            .then(config => (config && config.upload_size) || null)
+            .catch(err => null)
+            .then(size => {
+                if (!size) uploadSizePromise = null;
+                return size;
+            });
+    }
+    return uploadSizePromise;
+}
+
+// Copy of a large image scaled down to the upload size (aspect ratio and
+// EXIF orientation kept), or null when the original should be sent as-is
+async function downscaleUpload(blob) {
+    if (blob.size <= SMALL_UPLOAD_BYTES) return null;
+
+    const size = await getUploadSize();
+    if (!size) return null;
+
+    let bitmap;
+    try {
+        bitmap = await createImageBitmap(blob, { imageOrientation: "from-image" });
+    } catch (err) {
+        return null; // Not decodable here: let the backend report it
+    }
+
+    const scale = Math.max(size[0] / bitmap.width, size[1] / bitmap.height);
+    if (scale >= 1) {
+        bitmap.close();
+        return null;
+    }
+
+    const width = Math.max(1, Math.round(bitmap.width * scale));
+    const height = Math.max(1, Math.round(bitmap.height * scale));
+    const canvas = new OffscreenCanvas(width, height);
+    const ctx = canvas.getContext("2d");
+    ctx.imageSmoothingQuality = "high";
+    ctx.drawImage(bitmap, 0, 0, width, height);
+    bitmap.close();
+
+    // Quality 1 makes Chrome encode lossless WebP: no new compression artifacts for the model
+    const small = await canvas.convertToBlob({ type: "image/webp", quality: 1 });
+    return small.size < blob.size ? small : null;
+}
+
+// Detect an uploaded image; large ones go up downscaled, after the
+// original's metadata has been checked (the copy doesn't carry it)
+async function uploadImage(blob) {
+    const small = await downscaleUpload(blob);
+
+    if (small) {
+        const res = await fetch(`${BACKEND_URL}/provenance`, {
+            method: "POST",
+            headers: { "Content-Type": "application/octet-stream" },
+            body: blob.slice(0, PROVENANCE_PREFIX_BYTES)
+        });
+        if (res.status === 200) {
+            return res.json();
+        }
+    }
+
+    const body = small || blob;
+    const res = await fetch(`${BACKEND_URL}/upload/raw`, {
+        method: "POST",
+        headers: { "Content-Type": body.type || "application/octet-stream" },
+        body: body
+    });
+
+    if (!res.ok) {
+        throw new Error(`HTTP ${res.status}`);
+    }
+    return res.json();
+}
+
 chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
 
     // HOVER SCAN (URL)
@@ -33,18 +357,39 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
         
         chrome.runtime.sendMessage({ type: "analyzing" });
 
-        fetch("http://127.0.0.1:8000/detect", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ url: url })
-        })
-        .then(res => {
-            if (!res.ok) {
-                throw new Error(`HTTP ${res.status}`);
+        // A new hover from this tab supersedes the one still running
+        const tabId = sender.tab ? sender.tab.id : null;
+        const previous = hoverScans.get(tabId);
+        if (previous) {
+            cancelChannelScan(previous.id);
+        }
+
+        const scan = channelScan({ url: url, lane: "interactive" });
+        if (scan.id !== null) {
+            hoverScans.set(tabId, { id: scan.id, url: url });
+        }
+
+        scan.promise
+        .then(frame => {
+            if (frame.type === "error") {
+                throw new Error(frame.error || `HTTP ${frame.status}`);
             }
-            return res.json();
-        })
+            return frame.type === "cancelled" ? null : resultFromFrame(frame);
+        }, err => fetchDetect(url))
         .then(data => {
+            if (hoverScans.get(tabId) && hoverScans.get(tabId).id === scan.id) {
+                hoverScans.delete(tabId);
+            }
+
+            if (data === null) {
+                // Superseded: let the page scan this image again on its next hover
+                pendingRequests.delete(url);
+                if (sendResponse) {
+                    sendResponse({ success: false, cancelled: true });
+                }
+                return;
+            }
+
             // Cache the result
             requestCache.set(url, {
                 data: data,
@@ -88,21 +433,98 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
         return true; // Keep message channel open
     }
 
-    // UPLOAD SCAN (BASE64)
-    if (msg.type === "scan_upload") {
-        chrome.runtime.sendMessage({ type: "analyzing" });
+    // PAGE SCAN (MANY URLS, ONE REQUEST)
+    if (msg.type === "scan_batch") {
+        const tabId = sender.tab ? sender.tab.id : null;
 
-        fetch("http://127.0.0.1:8000/upload", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ image: msg.dataUrl })
-        })
-        .then(res => {
-            if (!res.ok) {
-                throw new Error(`HTTP ${res.status}`);
+        const deliver = (url, data) => {
+            if (tabId === null) return;
+            chrome.tabs.sendMessage(tabId, { type: "batch_result", url: url, data: data })
+                .catch(err => console.log("Tab not ready for batch result"));
+
+            if (data.prediction === "ai") {
+                chrome.tabs.sendMessage(tabId, { type: "highlight", url: url })
+                    .catch(err => console.log("Tab not ready for highlight"));
             }
-            return res.json();
+        };
+
+        const reportFailed = (failed) => {
+            if (failed.length === 0 || tabId === null) return;
+            chrome.tabs.sendMessage(tabId, { type: "batch_failed", urls: failed })
+                .catch(err => console.log("Tab not ready for batch failure"));
+        };
+
+        // Answer cached URLs right away and skip ones already in flight
+        // (the page may scan those again on hover)
+        const inFlight = [];
+        const urls = (msg.urls || []).filter(url => {
+            const cached = requestCache.get(url);
+            if (cached && Date.now() - cached.timestamp < CACHE_DURATION) {
+                deliver(url, cached.data);
+                return false;
+            }
+            if (pendingRequests.has(url)) {
+                inFlight.push(url);
+                return false;
+            }
+            return true;
+        });
+        reportFailed(inFlight);
+
+        if (urls.length === 0) return;
+
+        urls.forEach(url => pendingRequests.set(url, true));
+
+        const delivered = new Set();
+        const onResult = (url, data) => {
+            pendingRequests.delete(url);
+            delivered.add(url);
+
+            if (data.prediction !== "error") {
+                requestCache.set(url, {
+                    data: data,
+                    timestamp: Date.now()
+                });
+            }
+
+            deliver(url, data);
+        };
+
+        // One bulk-lane scan per URL over the channel, a few at a time;
+        // whatever the channel couldn't take goes to /detect/batch in one request
+        const unsent = [];
+        const mode = msg.ensemble !== false ? "ensemble" : "fast";
+
+        Promise.all(urls.map(url =>
+            bulkChannelScan({ url: url, lane: "bulk", mode: mode })
+            .then(frame => onResult(url, resultFromFrame(frame)), err => unsent.push(url))
+        ))
+        .then(() => {
+            if (unsent.length === 0) return;
+            return streamBatch(unsent, msg.ensemble !== false, line => onResult(line.url, line));
+        })
+        .catch(err => {
+            console.error("Batch scan error:", err);
         })
+        .finally(() => {
+            urls.forEach(url => pendingRequests.delete(url));
+
+            // Let the page scan these again on hover
+            reportFailed(urls.filter(url => !delivered.has(url)));
+        });
+
+        return;
+    }
+
+    // UPLOAD SCAN (BINARY)
+    if (msg.type === "scan_upload") {
+        chrome.runtime.sendMessage({ type: "analyzing" });
+
+        // The popup hands over a data URL; send the decoded bytes as the
+        // request body instead of base64 JSON
+        fetch(msg.dataUrl)
+        .then(res => res.blob())
+        .then(blob => uploadImage(blob))
         .then(data => {
             chrome.runtime.sendMessage({ type: "scan_result", data });
         })
@@ -5,11 +5,23 @@ let hoverTimer = null;
 let scannedImages = new Map();
 let pendingScans = new Set();
 let lastUrl = null;
+let hoveredUrl = null;
+
+// Background scans of images entering the viewport, so most hovers are
+// answered from results already computed
+const PREFETCH_BUDGET = 40;       // Background scans per page
+const PREFETCH_MIN_SIDE = 100;    // Skip icons and spacers (rendered px)
+const PREFETCH_FLUSH_DELAY = 300; // Images that appear together go in one batch
+let prefetchPage = location.href;
+let prefetchSpent = 0;
+let prefetchQueue = [];
+let prefetchTimer = null;
 
 // Initialize
 chrome.storage.sync.get(["enabled"], (res) => {
     enabled = res.enabled || false;
     console.log("Shield:", enabled ? "ON" : "OFF");
+    if (enabled) startPrefetch();
 });
 
 // Listen for messages
@@ -17,7 +29,10 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
     if (msg.type === "toggle") {
         enabled = msg.enabled;
         console.log("Shield toggle:", enabled ? "ON" : "OFF");
-        if (!enabled) {
+        if (enabled) {
+            startPrefetch();
+        } else {
+            stopPrefetch();
             removeAllHighlights();
             scannedImages.clear();
             pendingScans.clear();
@@ -31,6 +46,26 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
         sendResponse({success: true});
     }
     
+    if (msg.type === "batch_result") {
+        pendingScans.delete(msg.url);
+
+        // A failed background scan is retried by the next hover
+        if (msg.data.prediction !== "error") {
+            scannedImages.set(msg.url, msg.data);
+        }
+
+        // Prefetch finished while the user was already hovering this image
+        if (msg.url === hoveredUrl) {
+            showResult(msg.data);
+        }
+        sendResponse({success: true});
+    }
+    
+    if (msg.type === "batch_failed") {
+        msg.urls.forEach(url => pendingScans.delete(url));
+        sendResponse({success: true});
+    }
+    
     if (msg.type === "scan_result") {
         if (lastUrl) {
             scannedImages.set(lastUrl, msg.data);
@@ -306,6 +341,12 @@ function sendScanRequest(url) {
                     console.error("Runtime error:", error);
                 }
                 pendingScans.delete(url);
+                return;
+            }
+
+            // Superseded by a newer hover before it finished: allow a rescan
+            if (response && response.cancelled) {
+                pendingScans.delete(url);
             }
         });
     } catch (error) {
@@ -347,8 +388,15 @@ function handleHover(el) {
     console.log(`Found ${urls.length} image(s) on hover`);
     
     const url = urls[0];
-    
-    if (scannedImages.has(url) || pendingScans.has(url)) {
+    hoveredUrl = url;
+
+    // Already scanned in the background: answer right away
+    if (scannedImages.has(url)) {
+        showResult(scannedImages.get(url));
+        return;
+    }
+
+    if (pendingScans.has(url)) {
         console.log("Already processed");
         return;
     }
@@ -364,6 +412,7 @@ function handleHover(el) {
 }
 
 document.addEventListener("mouseout", (e) => {
+    hoveredUrl = null;
     if (hoverTimer) {
         console.log("Mouse left, clearing timer");
         clearTimeout(hoverTimer);
@@ -371,27 +420,108 @@ document.addEventListener("mouseout", (e) => {
     }
 }, true);
 
+// ----------------------------------------------------
+// VIEWPORT PREFETCH
+// ----------------------------------------------------
+
+function showResult(data) {
+    try {
+        chrome.runtime.sendMessage({ type: "scan_result", data: data }, () => {
+            // No popup open to show it: nothing to do
+            void chrome.runtime.lastError;
+        });
+    } catch (error) {
+        console.error("Send error:", error);
+    }
+}
+
+const viewportObserver = new IntersectionObserver((entries) => {
+    if (!enabled) return;
+
+    entries.forEach(entry => {
+        if (entry.isIntersecting && queuePrefetch(entry.target)) {
+            viewportObserver.unobserve(entry.target);
+        }
+    });
+}, { rootMargin: "200px" });
+
+function observeImages(root) {
+    if (root.tagName === "IMG") {
+        viewportObserver.observe(root);
+    } else if (root.querySelectorAll) {
+        root.querySelectorAll("img").forEach(img => viewportObserver.observe(img));
+    }
+}
+
+function startPrefetch() {
+    observeImages(document.body);
+}
+
+function stopPrefetch() {
+    viewportObserver.disconnect();
+    clearTimeout(prefetchTimer);
+    prefetchTimer = null;
+    prefetchQueue = [];
+}
+
+// Queue a visible image for a background scan; true once it needs no more watching
+function queuePrefetch(img) {
+    // Single-page apps: every new URL gets a fresh budget
+    if (location.href !== prefetchPage) {
+        prefetchPage = location.href;
+        prefetchSpent = 0;
+    }
+    if (prefetchSpent >= PREFETCH_BUDGET) return true;
+
+    const url = img.currentSrc || img.src;
+    if (!url || !url.startsWith("http")) return false; // Lazy image without its source yet
+
+    const rect = img.getBoundingClientRect();
+    if (rect.width < PREFETCH_MIN_SIDE || rect.height < PREFETCH_MIN_SIDE) return false;
+
+    if (scannedImages.has(url) || pendingScans.has(url)) return true;
+
+    pendingScans.add(url);
+    prefetchQueue.push(url);
+    prefetchSpent++;
+
+    if (!prefetchTimer) {
+        prefetchTimer = setTimeout(flushPrefetch, PREFETCH_FLUSH_DELAY);
+    }
+    return true;
+}
+
+function flushPrefetch() {
+    prefetchTimer = null;
+    const urls = prefetchQueue;
+    prefetchQueue = [];
+    if (!enabled || urls.length === 0) return;
+
+    console.log(`Prefetching ${urls.length} visible image(s)`);
+
+    // Low priority on the backend: hover scans overtake these
+    try {
+        chrome.runtime.sendMessage({ type: "scan_batch", urls: urls, ensemble: true });
+    } catch (error) {
+        urls.forEach(url => pendingScans.delete(url));
+        if (error.message && error.message.includes("Extension context invalidated")) {
+            enabled = false;
+            stopPrefetch();
+        }
+    }
+}
+
 // Watch for new images
-let observerTimeout = null;
 const observer = new MutationObserver((mutations) => {
     if (!enabled) return;
-    
-    if (observerTimeout) return;
-    
-    observerTimeout = setTimeout(() => {
-        observerTimeout = null;
-        
-        mutations.forEach((mutation) => {
-            mutation.addedNodes.forEach((node) => {
-                if (node.nodeType === 1 && node.tagName === "IMG") {
-                    const url = node.currentSrc || node.src;
-                    if (url && url.startsWith("http")) {
-                        console.log("New image loaded:", url.substring(0, 60));
-                    }
-                }
-            });
+
+    mutations.forEach((mutation) => {
+        mutation.addedNodes.forEach((node) => {
+            if (node.nodeType === 1) {
+                observeImages(node);
+            }
         });
-    }, 500);
+    });
 });
 
 observer.observe(document.body, {